@@ -1,27 +1,36 @@
-from flask import g, url_for, redirect, request
+from flask import flash, g, url_for, redirect, request
 from flask.ext.admin.contrib.fileadmin import FileAdmin
 from wtforms.fields import SelectField
 from wtforms.fields import PasswordField
-from flask.ext.admin import Admin, AdminIndexView, expose
+from flask.ext.admin import Admin, AdminIndexView, BaseView, expose
+from flask.ext.admin.actions import action
 # Flask-Admin contrib package provides out-of-the-box create,
 # read, update and delete functionalities in special views designed
 # to work with SQLAlchemy models.
 from flask.ext.admin.contrib.sqla import ModelView
+from sqlalchemy.orm import subqueryload
 
 from app import app, db
-from models import Entry, Tag, User
+from cache import invalidate_entries
+from comments import refresh_comment_counts
+from entries.forms import TagField
+from identity import has_admin_access
+from instrumentation import HISTOGRAM_BUCKETS, profiler
+from models import Comment, Entry, Tag, User
+from rendering import render_entry
 
 class AdminAuthentication(object):
     def is_accessible(self):
         """
         Check whether the current user is authenticated and is an administator.
         """
-        return g.user.is_authenticated and g.user.is_admin()
+        return has_admin_access(g.user)
 
 class BaseModelView(AdminAuthentication, ModelView):
     pass
 
-# Whenever a model is changed, a slug should be generated.
+# Whenever a model is changed, a slug should be generated. It is only
+# derived again when its source changed, and numbered on collision.
 class SlugModelView(BaseModelView):
     def on_model_change(self, form, model, is_created):
         model.generate_slug()
@@ -59,6 +68,12 @@ class EntryModelView(SlugModelView):
         'status': {'choices': _status_choices, 'coerce': int},    
     }
     form_columns = ['title', 'body', 'status', 'author', 'tags']
+    # Tags are typed as a comma-separated list, like in the entry form,
+    # instead of picked from a list of every tag.
+    form_extra_fields = {
+        'tags': TagField('Tags',
+                         description='Separate multiple tags with commas.'),
+    }
     form_overrides = {'status': SelectField}
     # When we are looking up the author, search on the author's name or email.    
     form_ajax_refs = {
@@ -67,6 +82,24 @@ class EntryModelView(SlugModelView):
         }    
     }
 
+    def on_model_change(self, form, model, is_created):
+        render_entry(model)
+        return super().on_model_change(form, model, is_created)
+
+    def get_query(self):
+        """
+        Load the tags of every listed entry in one extra query, the tag_list
+        column would otherwise trigger a lazy load per row.
+        """
+        return super().get_query().options(subqueryload(Entry.tags))
+
+class TagModelView(SlugModelView):
+    column_list = ['name', 'slug']
+    column_searchable_list = ['name']
+    # Entries are tagged from the entry forms, a field listing every entry
+    # here would load them all.
+    form_columns = ['name']
+
 class UserModelView(SlugModelView):
     column_list = ['email', 'name', 'active', 'admin', 'created_timestamp']
 
@@ -86,14 +119,103 @@ class UserModelView(SlugModelView):
             model.password_hash = User.make_password(form.password.data)
         return super().on_model_change(form, model, is_created)
 
+class CommentModelView(BaseModelView):
+    """
+    Moderation queue. The bulk actions change the status of every selected
+    comment with one UPDATE rather than loading and saving them one by one.
+    """
+    _status_choices = [
+        (Comment.STATUS_PENDING_MODERATION, 'Pending moderation'),
+        (Comment.STATUS_PUBLIC, 'Public'),
+        (Comment.STATUS_SPAM, 'Spam'),
+        (Comment.STATUS_DELETED, 'Deleted'),
+    ]
+
+    can_create = False
+    column_choices = {
+        'status': _status_choices,
+    }
+    # Both filters are served by the (entry_id, status) and status indexes.
+    column_filters = ['status', 'entry_id']
+    column_labels = {'entry_id': 'Entry id', 'ip_address': 'IP address'}
+    column_list = [
+        'entry', 'name', 'email', 'ip_address', 'body', 'status',
+        'created_timestamp'
+    ]
+    column_default_sort = ('id', True)
+    column_searchable_list = ['name', 'email', 'body']
+    column_select_related_list = ['entry']
+
+    form_args = {
+        'status': {'choices': _status_choices, 'coerce': int},
+    }
+    form_columns = ['name', 'email', 'url', 'body', 'status']
+    form_overrides = {'status': SelectField}
+
+    # Statement size stays under SQLite's limit of bound parameters.
+    _BATCH_SIZE = 500
+
+    def _set_status(self, ids, status):
+        ids = [int(comment_id) for comment_id in ids]
+        table = Comment.__table__
+        connection = db.session.connection()
+        entry_ids = set()
+        for start in range(0, len(ids), self._BATCH_SIZE):
+            batch = ids[start:start + self._BATCH_SIZE]
+            entry_ids.update(entry_id for entry_id, in connection.execute(
+                db.select([table.c.entry_id]).distinct()
+                .where(table.c.id.in_(batch))))
+            connection.execute(
+                table.update().where(table.c.id.in_(batch))
+                .values(status=status))
+        # The update bypasses the ORM events which maintain these.
+        entry_ids.discard(None)
+        refresh_comment_counts(connection, entry_ids)
+        db.session.commit()
+        invalidate_entries(db.session, entry_ids)
+        return len(ids)
+
+    @action('approve', 'Approve')
+    def action_approve(self, ids):
+        count = self._set_status(ids, Comment.STATUS_PUBLIC)
+        flash('{} comments approved.'.format(count), 'success')
+
+    @action('spam', 'Mark as spam')
+    def action_spam(self, ids):
+        count = self._set_status(ids, Comment.STATUS_SPAM)
+        flash('{} comments marked as spam.'.format(count), 'success')
+
+    @action('delete', 'Delete',
+            'Are you sure you want to delete the selected comments?')
+    def action_delete(self, ids):
+        count = self._set_status(ids, Comment.STATUS_DELETED)
+        flash('{} comments deleted.'.format(count), 'success')
+
 class BlogFileAdmin(AdminAuthentication, FileAdmin):
     pass
 
+class ProfilerView(AdminAuthentication, BaseView):
+    """
+    Latency, SQL and template statistics of the recent requests to each
+    endpoint, and the output of the sampled cProfile runs.
+    """
+    @expose('/')
+    def index(self):
+        return self.render('admin/profiler.html',
+                           buckets=HISTOGRAM_BUCKETS,
+                           endpoints=profiler.summaries(),
+                           profiles=list(profiler.profiles))
+
+    @expose('/reset/', methods=['POST'])
+    def reset(self):
+        profiler.reset()
+        return redirect(url_for('.index'))
+
 # This view renders a template.
 class IndexView(AdminIndexView):
     @expose('/')
     def index(self):
-        if not (g.user.is_authenticated and g.user.is_admin()):
+        if not has_admin_access(g.user):
             return redirect(url_for('login', next=request.path))
         return self.render('admin/index.html')
 
@@ -103,8 +225,10 @@ admin = Admin(app, 'Blog Admin', index_view=IndexView())
 # Call admin.admin_view and pass instances of the ModelView class
 # as well as the db session, for it to access the database with.
 admin.add_view(EntryModelView(Entry, db.session))
-admin.add_view(SlugModelView(Tag, db.session))
+admin.add_view(TagModelView(Tag, db.session))
 admin.add_view(UserModelView(User, db.session))
+admin.add_view(CommentModelView(Comment, db.session))
 admin.add_view(
     BlogFileAdmin(app.config['STATIC_DIR'], '/static/', name='Static Files')
-)
\ No newline at end of file
+)
+admin.add_view(ProfilerView(name='Profiler', endpoint='profiler'))
\ No newline at end of file
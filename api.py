@@ -1,8 +1,23 @@
+import hashlib, json, math
+
+from flask import Response, abort, jsonify, request
 from flask.ext.restless import ProcessingException
 
-from app import api
+from app import api, app, db
+from comments import COMMENTS_PER_PAGE, is_spam
 from entries.forms import CommentForm
+from helpers import is_modified
+from instrumentation import timed
 from models import Comment
+from ratelimit import comment_buckets
+
+# Upper bound for the results_per_page parameter of the comment API.
+MAX_COMMENTS_PER_PAGE = 100
+
+# The comment API returns these columns, gravatar is derived from the
+# stored email hash.
+_COMMENT_COLUMNS = (Comment.id, Comment.name, Comment.url, Comment.body,
+                    Comment.created_timestamp, Comment.email_hash)
 
 def post_preprocessor(data, **kwargs):
     """
@@ -10,23 +25,148 @@ def post_preprocessor(data, **kwargs):
     Validate the submitted coment.
     """
     form = CommentForm(data=data)
-    if form.validate():
-        return form.data
-    else:
+    with timed('forms'):
+        valid = form.validate()
+    if not valid:
         # If validation fails, signal to Flask-Restless that this
         # data was unprocessable and return a 400 Bad Request response.
         raise ProcessingException(
             description='Invalid form submission.',
             code=400)
+    # Flask-Restless creates the comment from data, modified in place. Keep
+    # the form fields only, the address and status are set here.
+    for name in set(data) - set(form.data):
+        del data[name]
+    data['ip_address'] = request.remote_addr
+    if is_spam(data['body'], data['ip_address']):
+        data['status'] = Comment.STATUS_SPAM
+
+@app.before_request
+def throttle_comments():
+    """
+    Reject comment submissions from an address posting too fast, before the
+    submission is parsed, validated or reaches the database.
+    """
+    if (request.method != 'POST' or request.path != '/api/comment' or
+            not app.config['COMMENT_RATE_LIMIT_ENABLED']):
+        return None
+    retry_after = comment_buckets.consume(request.remote_addr)
+    if retry_after:
+        response = jsonify(
+            message='Too many comments, please try again later.')
+        response.status_code = 429
+        response.headers['Retry-After'] = str(int(math.ceil(retry_after)))
+        return response
+
+def _filtered_entry_id():
+    """
+    Return the entry id of the entry_id filter sent by comments.js, None when
+    the comments are not filtered. Any other filter is rejected.
+    """
+    try:
+        filters = json.loads(request.args.get('q', '{}')).get('filters', [])
+    except (ValueError, AttributeError):
+        abort(400)
+    if not isinstance(filters, list):
+        abort(400)
+    entry_id = None
+    for comment_filter in filters:
+        if not (isinstance(comment_filter, dict) and
+                comment_filter.get('name') == 'entry_id' and
+                comment_filter.get('op') in ('eq', '==')):
+            abort(400)
+        entry_id = comment_filter.get('val')
+    return entry_id
+
+def _int_arg(name, default):
+    value = request.args.get(name)
+    if value is None:
+        return default
+    if not value.isdigit():
+        abort(400)
+    return int(value)
+
+def _serialize(row):
+    return json.dumps({
+        'id': row.id,
+        'name': row.name,
+        'url': row.url,
+        'body': row.body,
+        'created_timestamp': (row.created_timestamp.isoformat()
+                              if row.created_timestamp else None),
+        'gravatar': Comment.gravatar_url(row.email_hash),
+    })
+
+def _stream(num_results, rows, next_cursor):
+    """
+    Encode the response one comment at a time.
+    """
+    yield '{{"num_results": {}, "next_cursor": {}, "objects": ['.format(
+        num_results, json.dumps(next_cursor))
+    for i, row in enumerate(rows):
+        if i:
+            yield ', '
+        yield _serialize(row)
+    yield ']}'
+
+@app.route('/api/comment', methods=['GET'])
+def comment_list():
+    """
+    Return the public comments as JSON, oldest first. The response has the
+    same objects and num_results keys as the Flask-Restless API it replaces,
+    plus a next_cursor to pass as ?cursor= to fetch the following page.
+    """
+    entry_id = _filtered_entry_id()
+    cursor = _int_arg('cursor', 0)
+    per_page = min(_int_arg('results_per_page', COMMENTS_PER_PAGE),
+                   MAX_COMMENTS_PER_PAGE)
+
+    public = Comment.status == Comment.STATUS_PUBLIC
+    # Their number and newest id change when comments are added or
+    # removed, the newest modification time when one is edited or
+    # moderated, together they identify the version of the collection.
+    # No Last-Modified is sent: removing a comment or marking it as spam
+    # can leave the newest modification time as it was, only the ETag
+    # tells the versions apart.
+    validators = db.session.query(
+        db.func.count(Comment.id),
+        db.func.max(Comment.id),
+        db.func.max(Comment.modified_timestamp)).filter(public)
+    if entry_id is not None:
+        validators = validators.filter(Comment.entry_id == entry_id)
+    num_results, newest_id, last_modified = validators.one()
+    etag = hashlib.sha1(repr((
+        request.query_string, num_results, newest_id,
+        last_modified)).encode('utf-8')).hexdigest()
+    if not is_modified(etag):
+        response = app.response_class(status=304)
+    else:
+        query = db.session.query(*_COMMENT_COLUMNS).filter(public)
+        if entry_id is not None:
+            query = query.filter(Comment.entry_id == entry_id)
+        rows = (query
+                .filter(Comment.id > cursor)
+                .order_by(Comment.id)
+                .limit(per_page + 1)
+                .all())
+        next_cursor = None
+        if len(rows) > per_page:
+            rows = rows[:per_page]
+            next_cursor = rows[-1].id
+        response = Response(_stream(num_results, rows, next_cursor),
+                            mimetype='application/json')
+    response.set_etag(etag)
+    return response
 
 # Populate my app with additional URL routes and view code
 # that together, consitutes a RESTFUL API.
+# Reads are served by comment_list above.
 api.create_api(
     Comment,
-    methods=['GET', 'POST'],
+    methods=['POST'],
     # Restrict the Comment fields returned by the api.
     include_columns=['id', 'name', 'url', 'body', 'created_timestamp'],
     include_methods=['gravatar'],
     preprocessors={
         'POST': [post_preprocessor],
-    })
\ No newline at end of file
+    })
@@ -1,21 +1,55 @@
+import os, sqlite3
+
 from flask import Flask, g
 from flask.ext.restless import APIManager
-from flask.ext.bcrypt import Bcrypt
 from flask.ext.login import LoginManager, current_user
 from flask.ext.migrate import Migrate, MigrateCommand
 from flask.ext.script import Manager
 from flask.ext.sqlalchemy import SQLAlchemy
-
-# Import the configuration data.
-from config import Configuration
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
 
 app = Flask(__name__)
 
-# Use the values from the Configuration object in config.py
-app.config.from_object(Configuration)
+# Use the values from the Configuration object in config.py, or from the
+# profile named by BLOG_CONFIGURATION, e.g. config.PostgresConfiguration.
+app.config.from_object(
+    os.environ.get('BLOG_CONFIGURATION', 'config.Configuration'))
+
+class PooledSQLAlchemy(SQLAlchemy):
+    """
+    Flask-SQLAlchemy opens a new connection for every checkout from a SQLite
+    file database. Keep them in a QueuePool instead when
+    SQLALCHEMY_POOL_SIZE is set, so that the connect-time PRAGMAs run once
+    per connection rather than once per request.
+    """
+    def apply_driver_hacks(self, app, info, options):
+        super().apply_driver_hacks(app, info, options)
+        if (info.drivername == 'sqlite' and 'poolclass' not in options and
+                options.get('pool_size')):
+            options['poolclass'] = QueuePool
+            # Pooled connections move between the request threads, but are
+            # only used by one of them at a time.
+            options.setdefault('connect_args', {})['check_same_thread'] = False
 
 # Create an object to manage the database connections.
-db = SQLAlchemy(app)
+db = PooledSQLAlchemy(app)
+
+# Listen on the Engine class so that the PRAGMAs apply to whichever SQLite
+# engine Flask-SQLAlchemy ends up creating.
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    Tune each new SQLite connection with the SQLITE_PRAGMAS from the
+    configuration.
+    """
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in app.config['SQLITE_PRAGMAS']:
+        cursor.execute('PRAGMA {}={}'.format(name, value))
+    cursor.close()
 
 migrate = Migrate(app, db)
 
@@ -37,6 +71,3 @@ def before_request():
     """
     # g object can be used to store arbitrary values-per-request.
     g.user = current_user
-    
-# Register bcrypt with app.
-bcrypt = Bcrypt(app)
\ No newline at end of file
@@ -0,0 +1,142 @@
+import gzip, hashlib, json, mimetypes, os, re, shutil
+
+from flask import request, send_from_directory
+
+from app import app
+
+try:
+    import brotli
+except ImportError:
+    # Brotli variants are only built when the brotli package is installed.
+    brotli = None
+
+# Types worth compressing, images are compressed already.
+COMPRESSIBLE_EXTENSIONS = ('.css', '.html', '.js', '.json', '.svg', '.txt',
+                           '.xml')
+
+# Uploaded images are stored under the hash of their content, see images.py.
+_CONTENT_ADDRESSED = re.compile(r'^[0-9a-f]{32}\.\w+$')
+
+# Maps the name of each source file to the name of its hashed copy, both
+# relative to STATIC_DIR, e.g. js/comments.js -> build/js/comments.1a2b3c.js
+_manifest = {}
+_hashed_files = set()
+
+def _manifest_path():
+    return os.path.join(app.config['ASSETS_BUILD_DIR'], 'manifest.json')
+
+def load_manifest():
+    """
+    Read the manifest written by build_assets, when there is one.
+    """
+    _manifest.clear()
+    _hashed_files.clear()
+    try:
+        with open(_manifest_path()) as fileobj:
+            _manifest.update(json.load(fileobj))
+    except FileNotFoundError:
+        pass
+    _hashed_files.update(_manifest.values())
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fileobj:
+        for chunk in iter(lambda: fileobj.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+def _write_compressed(path):
+    with open(path, 'rb') as fileobj:
+        data = fileobj.read()
+    # A fixed mtime keeps the output identical between builds.
+    with open(path + '.gz', 'wb') as fileobj:
+        with gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=9,
+                           mtime=0) as gzip_file:
+            gzip_file.write(data)
+    if brotli is not None:
+        with open(path + '.br', 'wb') as fileobj:
+            fileobj.write(brotli.compress(data))
+
+def build_assets():
+    """
+    Copy every file under STATIC_DIR to ASSETS_BUILD_DIR under a name which
+    contains the hash of its content, write the precompressed variants and
+    the manifest. Returns the number of files in the manifest.
+    """
+    static_dir = app.config['STATIC_DIR']
+    build_dir = app.config['ASSETS_BUILD_DIR']
+    manifest = {}
+    for root, dirs, files in os.walk(static_dir):
+        # Do not descend into the build directory.
+        dirs[:] = [name for name in dirs if os.path.abspath(
+            os.path.join(root, name)) != os.path.abspath(build_dir)]
+        for name in files:
+            if _CONTENT_ADDRESSED.match(name):
+                # Already named after their content.
+                continue
+            source = os.path.join(root, name)
+            relative = os.path.relpath(source, static_dir)
+            stem, extension = os.path.splitext(relative)
+            target = os.path.join(build_dir, '{}.{}{}'.format(
+                stem, _file_hash(source), extension))
+            if not os.path.exists(target):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copyfile(source, target)
+                if extension.lower() in COMPRESSIBLE_EXTENSIONS:
+                    _write_compressed(target)
+            # URLs always use forward slashes.
+            manifest[relative.replace(os.sep, '/')] = os.path.relpath(
+                target, static_dir).replace(os.sep, '/')
+    os.makedirs(build_dir, exist_ok=True)
+    temp_path = _manifest_path() + '.tmp'
+    with open(temp_path, 'w') as fileobj:
+        json.dump(manifest, fileobj, indent=2, sort_keys=True)
+    os.replace(temp_path, _manifest_path())
+    load_manifest()
+    return len(manifest)
+
+@app.url_defaults
+def _hashed_static_url(endpoint, values):
+    # url_for('static', filename='js/comments.js') points to the hashed
+    # copy once the assets are built.
+    if endpoint == 'static' and values.get('filename') in _manifest:
+        values['filename'] = _manifest[values['filename']]
+
+def _is_immutable(filename):
+    return (filename in _hashed_files or
+            _CONTENT_ADDRESSED.match(os.path.basename(filename)) is not None)
+
+def static(filename):
+    """
+    Serve the static files, far-future cached when their name changes with
+    their content, and precompressed when a variant was built.
+    """
+    if not _is_immutable(filename):
+        return app.send_static_file(filename)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    compressible = (os.path.splitext(filename)[1].lower() in
+                    COMPRESSIBLE_EXTENSIONS)
+    encoding = None
+    if compressible:
+        for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if (request.accept_encodings[candidate] and os.path.exists(
+                    os.path.join(app.config['STATIC_DIR'],
+                                 filename + suffix))):
+                encoding = candidate
+                filename += suffix
+                break
+    response = send_from_directory(app.config['STATIC_DIR'], filename,
+                                   mimetype=mimetype)
+    if compressible:
+        response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['ASSETS_MAX_AGE']
+    response.headers['Cache-Control'] += ', immutable'
+    return response
+
+# Replace the view of the static endpoint, url_for('static') is unchanged.
+app.view_functions['static'] = static
+
+load_manifest()
@@ -0,0 +1,322 @@
+import datetime, json
+
+from sqlalchemy import select
+
+from app import db
+from models import Comment, Entry, Tag, User, entry_tags
+from slugs import unique_slug
+from tags import resolve_tag_ids
+
+# Record types in the order they are written, and flushed on import, so that
+# rows are always inserted after the rows they reference.
+RECORD_TYPES = ('user', 'tag', 'entry', 'entry_tag', 'comment')
+
+_TABLES = {
+    'user': User.__table__,
+    'tag': Tag.__table__,
+    'entry': Entry.__table__,
+    'entry_tag': entry_tags,
+    'comment': Comment.__table__,
+}
+
+# Derived columns are rebuilt after an import rather than copied.
+_SKIPPED_COLUMNS = {
+    'entry': ('comment_count', 'body_html', 'tease_text', 'render_version'),
+    'comment': ('email_hash',),
+}
+
+_DATETIME_FORMATS = ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S')
+
+def _encode(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+def _parse_datetime(value):
+    for fmt in _DATETIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise ValueError('Invalid datetime: {}'.format(value))
+
+def _columns(record_type):
+    skipped = _SKIPPED_COLUMNS.get(record_type, ())
+    return [column for column in _TABLES[record_type].c
+            if column.name not in skipped]
+
+def _stream_rows(connection, query, chunk_size):
+    result = connection.execution_options(stream_results=True).execute(query)
+    while True:
+        rows = result.fetchmany(chunk_size)
+        if not rows:
+            break
+        for row in rows:
+            yield row
+
+def export_records(connection, chunk_size=1000):
+    """
+    Yield every user, tag, entry, tag assignment and comment as a dictionary
+    with a "type" key, reading the tables a chunk at a time.
+    """
+    for record_type in ('user', 'tag', 'entry', 'comment'):
+        columns = _columns(record_type)
+        query = select(columns).order_by(_TABLES[record_type].c.id)
+        for row in _stream_rows(connection, query, chunk_size):
+            record = {'type': record_type}
+            record.update((column.name, _encode(row[column]))
+                          for column in columns)
+            yield record
+
+    # Assignments refer to tags by name, so that tags can be merged into
+    # those of the database being imported into.
+    query = (select([entry_tags.c.entry_id, Tag.__table__.c.name])
+             .select_from(entry_tags.join(Tag.__table__))
+             .order_by(entry_tags.c.entry_id))
+    for entry_id, tag_name in _stream_rows(connection, query, chunk_size):
+        yield {'type': 'entry_tag', 'entry_id': entry_id, 'tag': tag_name}
+
+def export_jsonl(connection, fileobj, chunk_size=1000):
+    """
+    Write the content of the blog to fileobj, one JSON record per line.
+    Returns the number of records written.
+    """
+    count = 0
+    for record in export_records(connection, chunk_size):
+        fileobj.write(json.dumps(record))
+        fileobj.write('\n')
+        count += 1
+    return count
+
+# Exported ids are not kept, rows are matched with those already in the
+# database on these columns and inserted under new ids when missing.
+_NATURAL_KEYS = {
+    'user': 'email',
+    'entry': 'slug',
+}
+
+# Keeps SELECT ... IN lists under the SQLite limit of bound parameters.
+_IN_CHUNK_SIZE = 500
+
+def _chunks(values):
+    values = list(values)
+    for start in range(0, len(values), _IN_CHUNK_SIZE):
+        yield values[start:start + _IN_CHUNK_SIZE]
+
+class Importer(object):
+    """
+    Insert JSONL records with batched executemany statements, committing
+    every batch_size records. Users are matched on their email and entries
+    on their slug with those already in the database, comments on their
+    entry, email and creation time, and only the missing rows are inserted.
+    The maps of exported to new user and entry ids are kept in memory, so
+    that the records which follow are attached to the right rows.
+    """
+    def __init__(self, connection, batch_size=1000):
+        self.connection = connection
+        self.batch_size = batch_size
+        self.pending = dict((record_type, []) for record_type in RECORD_TYPES)
+        self.pending_count = 0
+        self.counts = dict.fromkeys(RECORD_TYPES, 0)
+        self.id_maps = {'user': {}, 'entry': {}}
+        tag_table = Tag.__table__
+        self.tag_ids = dict(connection.execute(
+            select([tag_table.c.name, tag_table.c.id])).fetchall())
+        self.transaction = connection.begin()
+
+    def _convert(self, record_type, record):
+        row = {}
+        for column in _columns(record_type):
+            value = record.get(column.name)
+            if (value is not None and
+                    isinstance(column.type, db.DateTime)):
+                value = _parse_datetime(value)
+            row[column.name] = value
+        if record_type == 'comment':
+            row['email_hash'] = Comment.hash_email(row['email'])
+            if row['modified_timestamp'] is None:
+                # Exported before comments had a modification time.
+                row['modified_timestamp'] = row['created_timestamp']
+        return row
+
+    def add(self, record):
+        record_type = record.get('type')
+        if record_type not in self.pending:
+            raise ValueError('Unknown record type: {}'.format(record_type))
+        if record_type == 'tag':
+            if record['name'] in self.tag_ids:
+                return
+            # Remember the name now, the id is known once the batch is in.
+            self.tag_ids[record['name']] = None
+            row = {'name': record['name'], 'slug': record.get('slug')}
+        elif record_type == 'entry_tag':
+            row = {'entry_id': record['entry_id'], 'tag': record['tag']}
+        else:
+            row = self._convert(record_type, record)
+        self.pending[record_type].append(row)
+        self.pending_count += 1
+        if self.pending_count >= self.batch_size:
+            self.flush()
+
+    def _select_in(self, columns, column, values):
+        query = select(columns)
+        for chunk in _chunks(set(values)):
+            for row in self.connection.execute(query.where(
+                    column.in_(chunk))):
+                yield row
+
+    def _ids_by_key(self, table, key, values):
+        return dict(self._select_in([table.c[key], table.c.id],
+                                    table.c[key], values))
+
+    def _insert_row(self, table, row):
+        result = self.connection.execute(table.insert(), row)
+        return result.inserted_primary_key[0]
+
+    def _merge(self, record_type, rows):
+        """
+        Insert the rows whose natural key is not in the table yet, leaving
+        their ids to the database, and map every exported id to the id of
+        the matching row.
+        """
+        table = _TABLES[record_type]
+        key = _NATURAL_KEYS[record_type]
+        ids = self._ids_by_key(table, key,
+                               [row[key] for row in rows
+                                if row[key] is not None])
+        new_rows = []
+        for row in rows:
+            if row[key] is not None and row[key] in ids:
+                continue
+            row = dict(row)
+            exported_id = row.pop('id')
+            if row[key] is None:
+                # Nothing to match it on, it needs an id of its own now.
+                self.id_maps[record_type][exported_id] = self._insert_row(
+                    table, row)
+                self.counts[record_type] += 1
+                continue
+            # Repeated within the file, the first record wins.
+            ids[row[key]] = None
+            new_rows.append(row)
+        if new_rows:
+            self.connection.execute(table.insert(), new_rows)
+            self.counts[record_type] += len(new_rows)
+            ids.update(self._ids_by_key(table, key,
+                                        [row[key] for row in new_rows]))
+        for row in rows:
+            if row[key] is not None:
+                self.id_maps[record_type][row['id']] = ids[row[key]]
+
+    def _prepare_users(self, rows):
+        # A new user may still have the slug of an existing one.
+        slug_column = User.__table__.c.slug
+        taken = set(slug for slug, in self._select_in(
+            [slug_column], slug_column,
+            [row['slug'] for row in rows if row['slug']]))
+        existing = self._ids_by_key(User.__table__, 'email',
+                                    [row['email'] for row in rows])
+        for row in rows:
+            if row['email'] in existing or not row['slug']:
+                continue
+            if row['slug'] in taken:
+                row['slug'] = unique_slug(self.connection, slug_column,
+                                          row['slug'], reserved=taken)
+            taken.add(row['slug'])
+        return rows
+
+    def _prepare_entries(self, rows):
+        user_ids = self.id_maps['user']
+        for row in rows:
+            row['author_id'] = user_ids.get(row['author_id'])
+        return rows
+
+    def _prepare_entry_tags(self, rows):
+        entry_ids = self.id_maps['entry']
+        pairs = set()
+        for row in rows:
+            pair = (entry_ids.get(row['entry_id']),
+                    self.tag_ids.get(row['tag']))
+            if None not in pair:
+                pairs.add(pair)
+        # Entries which were already there may have the tag already.
+        pairs.difference_update(
+            tuple(row) for row in self._select_in(
+                [entry_tags.c.entry_id, entry_tags.c.tag_id],
+                entry_tags.c.entry_id, [entry_id for entry_id, _ in pairs]))
+        return [{'entry_id': entry_id, 'tag_id': tag_id}
+                for entry_id, tag_id in sorted(pairs)]
+
+    def _prepare_comments(self, rows):
+        entry_ids = self.id_maps['entry']
+        table = Comment.__table__
+        comments = []
+        for row in rows:
+            row = dict(row, entry_id=entry_ids.get(row['entry_id']))
+            del row['id']
+            if row['entry_id'] is not None:
+                comments.append(row)
+        existing = set(tuple(row) for row in self._select_in(
+            [table.c.entry_id, table.c.email, table.c.created_timestamp],
+            table.c.entry_id, [row['entry_id'] for row in comments]))
+        new_rows = []
+        for row in comments:
+            key = (row['entry_id'], row['email'], row['created_timestamp'])
+            if key not in existing:
+                existing.add(key)
+                new_rows.append(row)
+        return new_rows
+
+    def flush(self):
+        """
+        Insert and commit every pending record, parents first.
+        """
+        for record_type in RECORD_TYPES:
+            rows = self.pending[record_type]
+            if not rows:
+                continue
+            if record_type == 'tag':
+                # Tags are merged by name into the existing ones.
+                self.tag_ids.update(resolve_tag_ids(
+                    self.connection, [row['name'] for row in rows],
+                    dict((row['name'], row['slug']) for row in rows)))
+                self.counts[record_type] += len(rows)
+            elif record_type in _NATURAL_KEYS:
+                if record_type == 'user':
+                    rows = self._prepare_users(rows)
+                else:
+                    rows = self._prepare_entries(rows)
+                self._merge(record_type, rows)
+            else:
+                if record_type == 'entry_tag':
+                    rows = self._prepare_entry_tags(rows)
+                else:
+                    rows = self._prepare_comments(rows)
+                if rows:
+                    self.connection.execute(
+                        _TABLES[record_type].insert(), rows)
+                    self.counts[record_type] += len(rows)
+            self.pending[record_type] = []
+        self.pending_count = 0
+        self.transaction.commit()
+        self.transaction = self.connection.begin()
+
+    def close(self):
+        self.flush()
+        self.transaction.commit()
+
+def import_jsonl(connection, fileobj, batch_size=1000):
+    """
+    Read JSONL records from fileobj and insert them. Returns the number of
+    rows of each type inserted, records matching existing rows are not
+    counted.
+    """
+    importer = Importer(connection, batch_size)
+    for line in fileobj:
+        line = line.strip()
+        if line:
+            importer.add(json.loads(line))
+    importer.close()
+    return importer.counts
@@ -0,0 +1,341 @@
+import functools, pickle, sqlite3, threading, time
+from collections import OrderedDict
+
+from flask import g, make_response, request, session
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from app import app
+from helpers import is_modified
+from models import Comment, Entry, Tag, User, entry_tags
+
+# Dependency shared by every page listing entries.
+ENTRY_LIST = 'entry-list'
+# Dependency of the pages listing tags, any tag change affects them.
+TAG_LIST = 'tag-list'
+
+def entry_key(entry_id):
+    return 'entry:{}'.format(entry_id)
+
+def tag_key(tag_id):
+    return 'tag:{}'.format(tag_id)
+
+def author_key(user_id):
+    return 'author:{}'.format(user_id)
+
+class MemoryCache(object):
+    """
+    In-process LRU cache with per-key expiry and a bounded number of keys.
+    Each key can be registered under dependency names, invalidating a
+    dependency evicts every key registered under it.
+    """
+    def __init__(self, max_entries=1000, default_ttl=300):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._data = OrderedDict()
+        # dependency -> keys, and key -> dependencies to clean the former up
+        # whenever a key goes away.
+        self._dependencies = {}
+        self._key_dependencies = {}
+        self._lock = threading.Lock()
+
+    def _remove(self, key):
+        # Called with the lock held.
+        self._data.pop(key, None)
+        for dependency in self._key_dependencies.pop(key, ()):
+            keys = self._dependencies.get(dependency)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._dependencies[dependency]
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.time():
+                self._remove(key)
+                return None
+            # Mark the key as the most recently used.
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None, dependencies=()):
+        expires = time.time() + (ttl or self.default_ttl)
+        with self._lock:
+            self._remove(key)
+            self._data[key] = (value, expires)
+            dependencies = set(dependencies)
+            if dependencies:
+                self._key_dependencies[key] = dependencies
+            for dependency in dependencies:
+                self._dependencies.setdefault(dependency, set()).add(key)
+            while len(self._data) > self.max_entries:
+                self._remove(next(iter(self._data)))
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def invalidate(self, dependencies):
+        with self._lock:
+            for dependency in dependencies:
+                for key in list(self._dependencies.get(dependency, ())):
+                    self._remove(key)
+
+    def clear(self):
+        """
+        Empty the cache of this process only, other processes keep theirs.
+        """
+        with self._lock:
+            self._data.clear()
+            self._dependencies.clear()
+            self._key_dependencies.clear()
+
+class SQLiteCache(object):
+    """
+    Cache stored in a local SQLite file, shared by every worker process
+    on the host. Same interface as MemoryCache.
+    """
+    def __init__(self, path, max_entries=10000, default_ttl=300):
+        self.path = path
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                'key TEXT PRIMARY KEY, value BLOB, expires REAL)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache_dependency ('
+                'dependency TEXT, key TEXT, '
+                'PRIMARY KEY (dependency, key)) WITHOUT ROWID')
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)')
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS cache_dependency_key '
+                'ON cache_dependency (key)')
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared between threads.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connection().execute(
+            'SELECT value FROM cache WHERE key = ? AND expires >= ?',
+            (key, time.time())).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(row[0])
+
+    def set(self, key, value, ttl=None, dependencies=()):
+        expires = time.time() + (ttl or self.default_ttl)
+        with self._connection() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO cache (key, value, expires) '
+                'VALUES (?, ?, ?)', (key, pickle.dumps(value), expires))
+            conn.execute(
+                'DELETE FROM cache_dependency WHERE key = ?', (key,))
+            conn.executemany(
+                'INSERT OR IGNORE INTO cache_dependency (dependency, key) '
+                'VALUES (?, ?)', [(dep, key) for dep in dependencies])
+            # Drop expired keys, then the keys closest to expiring.
+            removed = conn.execute(
+                'DELETE FROM cache WHERE expires < ?', (time.time(),)).rowcount
+            removed += conn.execute(
+                'DELETE FROM cache WHERE key IN (SELECT key FROM cache '
+                'ORDER BY expires DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)).rowcount
+            if removed:
+                # Along with the dependencies of the keys dropped.
+                conn.execute(
+                    'DELETE FROM cache_dependency WHERE NOT EXISTS ('
+                    'SELECT 1 FROM cache '
+                    'WHERE cache.key = cache_dependency.key)')
+
+    def delete(self, key):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+            conn.execute(
+                'DELETE FROM cache_dependency WHERE key = ?', (key,))
+
+    def invalidate(self, dependencies):
+        dependencies = list(dependencies)
+        if not dependencies:
+            return
+        placeholders = ', '.join('?' for dep in dependencies)
+        with self._connection() as conn:
+            evicted = ('SELECT key FROM cache_dependency '
+                       'WHERE dependency IN ({})'.format(placeholders))
+            conn.execute(
+                'DELETE FROM cache WHERE key IN ({})'.format(evicted),
+                dependencies)
+            # Every dependency of the evicted keys goes, not only those
+            # invalidated.
+            conn.execute(
+                'DELETE FROM cache_dependency WHERE key IN ({})'.format(
+                    evicted), dependencies)
+
+    def clear(self):
+        """
+        Empty the cache for every process sharing the file.
+        """
+        with self._connection() as conn:
+            conn.execute('DELETE FROM cache')
+            conn.execute('DELETE FROM cache_dependency')
+
+def make_cache(config):
+    """
+    Create the page cache backend selected in the configuration.
+    """
+    if config['PAGE_CACHE_BACKEND'] == 'sqlite':
+        return SQLiteCache(
+            config['PAGE_CACHE_PATH'],
+            max_entries=config['PAGE_CACHE_MAX_ENTRIES'],
+            default_ttl=config['PAGE_CACHE_TTL'])
+    return MemoryCache(
+        max_entries=config['PAGE_CACHE_MAX_ENTRIES'],
+        default_ttl=config['PAGE_CACHE_TTL'])
+
+page_cache = make_cache(app.config)
+
+# Functions called with the dependencies of every invalidation, for the
+# caches of other modules, see fragments.py.
+invalidation_listeners = []
+
+def invalidate(dependencies):
+    """
+    Evict the pages registered under any of the dependencies, and tell the
+    invalidation listeners.
+    """
+    dependencies = set(dependencies)
+    page_cache.invalidate(dependencies)
+    for listener in invalidation_listeners:
+        listener(dependencies)
+
+# Response headers replayed along with a cached page body.
+_STORED_HEADERS = ('ETag', 'Last-Modified', 'Vary')
+
+def depends_on(*dependencies):
+    """
+    Declare what the page being rendered depends on, so that it is evicted
+    when one of those objects changes.
+    """
+    if hasattr(g, 'cache_dependencies'):
+        g.cache_dependencies.update(dependencies)
+
+def _is_cacheable():
+    # Logged-in users see drafts and edit links, flashed messages are
+    # one-off. Only anonymous GETs without pending messages are shared.
+    return (app.config['PAGE_CACHE_ENABLED'] and
+            request.method == 'GET' and
+            not g.user.is_authenticated and
+            '_flashes' not in session)
+
+def cached_page(view):
+    """
+    Serve anonymous GET requests for the decorated view from the page cache.
+    """
+    @functools.wraps(view)
+    def inner(*args, **kwargs):
+        if not _is_cacheable():
+            return view(*args, **kwargs)
+        key = 'page:{}'.format(request.full_path)
+        cached = page_cache.get(key)
+        if cached is not None:
+            body, headers = cached
+            response = make_response(body)
+            response.headers.extend(headers)
+            response.headers['X-Cache'] = 'HIT'
+            # Validators were stored with the page, answer 304 from them.
+            last_modified = response.last_modified
+            if 'ETag' in response.headers and not is_modified(
+                    response.get_etag()[0], last_modified):
+                response.status_code = 304
+                response.set_data(b'')
+            return response
+
+        g.cache_dependencies = set()
+        response = make_response(view(*args, **kwargs))
+        if response.status_code == 200 and g.cache_dependencies:
+            headers = [(name, value) for name, value in response.headers
+                       if name in _STORED_HEADERS]
+            page_cache.set(key, (response.get_data(), headers),
+                           dependencies=g.cache_dependencies)
+        response.headers['X-Cache'] = 'MISS'
+        return response
+    return inner
+
+def _entry_dependencies(entry):
+    dependencies = {entry_key(entry.id), ENTRY_LIST}
+    # Pages of tags the entry was just added to or removed from are
+    # affected as well as those of its current tags.
+    tags = inspect(entry).attrs.tags.load_history().sum()
+    dependencies.update(tag_key(tag.id) for tag in tags if tag.id)
+    # Likewise for the previous author of an entry given to someone else.
+    author_ids = inspect(entry).attrs.author_id.history.sum()
+    dependencies.update(author_key(user_id)
+                        for user_id in set(author_ids) | {entry.author_id}
+                        if user_id is not None)
+    return dependencies
+
+def _changed_dependencies(session):
+    dependencies = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Entry):
+            dependencies.update(_entry_dependencies(obj))
+        elif isinstance(obj, Tag):
+            dependencies.update((tag_key(obj.id), TAG_LIST))
+        elif isinstance(obj, User):
+            dependencies.add(author_key(obj.id))
+        elif isinstance(obj, Comment):
+            dependencies.update(
+                _entries_dependencies(session, [obj.entry_id]))
+    return dependencies
+
+def _entries_dependencies(connection, entry_ids):
+    # Lists show comment counts, so they change along with the entries.
+    dependencies = {ENTRY_LIST}
+    dependencies.update(entry_key(entry_id) for entry_id in entry_ids)
+    tag_ids = connection.execute(
+        select([entry_tags.c.tag_id]).distinct()
+        .where(entry_tags.c.entry_id.in_(list(entry_ids))))
+    dependencies.update(tag_key(tag_id) for tag_id, in tag_ids)
+    author_ids = connection.execute(
+        select([Entry.author_id]).distinct()
+        .where(Entry.id.in_(list(entry_ids))))
+    dependencies.update(author_key(user_id) for user_id, in author_ids
+                        if user_id is not None)
+    return dependencies
+
+def invalidate_entries(connection, entry_ids):
+    """
+    Evict the pages showing the given entries, after a set-based update
+    which the session events below do not see.
+    """
+    entry_ids = list(entry_ids)
+    if entry_ids:
+        invalidate(_entries_dependencies(connection, entry_ids))
+
+@event.listens_for(Session, 'after_flush')
+def _collect_dependencies(session, flush_context):
+    # Ids are assigned by now, remember them until the commit succeeds.
+    pending = session.info.setdefault('page_cache_dependencies', set())
+    pending.update(_changed_dependencies(session))
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_pages(session):
+    pending = session.info.pop('page_cache_dependencies', None)
+    if pending:
+        invalidate(pending)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_dependencies(session):
+    session.info.pop('page_cache_dependencies', None)
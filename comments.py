@@ -0,0 +1,123 @@
+import re, time
+
+from sqlalchemy import event, inspect, select
+
+from app import app, db
+from models import Comment, Entry
+from ratelimit import comment_buckets
+
+# Number of comments embedded in the entry detail page.
+COMMENTS_PER_PAGE = 20
+
+_entry_table = Entry.__table__
+_comment_table = Comment.__table__
+
+_LINK = re.compile(r'https?://|www\.', re.IGNORECASE)
+
+def public_comments(entry, limit=COMMENTS_PER_PAGE):
+    """
+    Return the first page of public comments on the entry, oldest first,
+    and whether more comments follow, using a single query.
+    """
+    comments = (entry.comments
+                .filter(Comment.status == Comment.STATUS_PUBLIC)
+                .order_by(Comment.id)
+                .limit(limit + 1)
+                .all())
+    return comments[:limit], len(comments) > limit
+
+def is_spam(body, ip_address):
+    """
+    Determine whether a new comment should be held as spam: it has too many
+    links, or comes from an address which was recently throttled.
+    """
+    if len(_LINK.findall(body or '')) > app.config['COMMENT_SPAM_MAX_LINKS']:
+        return True
+    since = time.time() - app.config['COMMENT_SPAM_WINDOW']
+    return comment_buckets.throttled_since(ip_address, since)
+
+@app.template_global()
+def comment_counts(entries):
+    """
+    Return a dictionary mapping the id of each entry to its number of public
+    comments, for a whole page of entries at once.
+    """
+    entries = list(entries)
+    if app.config['DENORMALIZED_COMMENT_COUNTS']:
+        return {entry.id: entry.comment_count for entry in entries}
+    counts = dict.fromkeys([entry.id for entry in entries], 0)
+    if counts:
+        # One grouped aggregate for the page instead of a count per entry.
+        query = (db.session.query(Comment.entry_id,
+                                  db.func.count(Comment.id))
+                 .filter(Comment.entry_id.in_(list(counts)))
+                 .filter(Comment.status == Comment.STATUS_PUBLIC)
+                 .group_by(Comment.entry_id))
+        counts.update(query)
+    return counts
+
+def refresh_comment_counts(connection, entry_ids=None):
+    """
+    Recompute Entry.comment_count from the comment table, for the given
+    entries or for all of them. Used after set-based comment updates which
+    bypass the ORM events below.
+    """
+    count = (select([db.func.count(_comment_table.c.id)])
+             .where(_comment_table.c.entry_id == _entry_table.c.id)
+             .where(_comment_table.c.status == Comment.STATUS_PUBLIC)
+             .as_scalar())
+    statement = _entry_table.update().values(
+        comment_count=count,
+        # Keep the onupdate hook from touching the entry's own timestamp.
+        modified_timestamp=_entry_table.c.modified_timestamp)
+    if entry_ids is not None:
+        entry_ids = list(entry_ids)
+        if not entry_ids:
+            return
+        statement = statement.where(_entry_table.c.id.in_(entry_ids))
+    connection.execute(statement)
+
+def _adjust_count(connection, entry_id, delta):
+    if entry_id is None or not delta:
+        return
+    connection.execute(
+        _entry_table.update()
+        .where(_entry_table.c.id == entry_id)
+        .values(comment_count=_entry_table.c.comment_count + delta,
+                modified_timestamp=_entry_table.c.modified_timestamp))
+
+def _old_value(state, name):
+    history = state.attrs[name].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(state.obj(), name)
+
+@event.listens_for(Comment, 'before_insert')
+@event.listens_for(Comment, 'before_update')
+def _hash_email(mapper, connection, comment):
+    # Readers of the comment API get the gravatar without hashing per row.
+    comment.email_hash = Comment.hash_email(comment.email)
+
+# The counter is updated by the flush which writes the comment, so it
+# commits or rolls back together with it.
+@event.listens_for(Comment, 'after_insert')
+def _count_new_comment(mapper, connection, comment):
+    if comment.status == Comment.STATUS_PUBLIC:
+        _adjust_count(connection, comment.entry_id, 1)
+
+@event.listens_for(Comment, 'after_update')
+def _recount_comment(mapper, connection, comment):
+    state = inspect(comment)
+    old_public = _old_value(state, 'status') == Comment.STATUS_PUBLIC
+    new_public = comment.status == Comment.STATUS_PUBLIC
+    old_entry_id = _old_value(state, 'entry_id')
+    if old_public and (not new_public or old_entry_id != comment.entry_id):
+        _adjust_count(connection, old_entry_id, -1)
+    if new_public and (not old_public or old_entry_id != comment.entry_id):
+        _adjust_count(connection, comment.entry_id, 1)
+
+@event.listens_for(Comment, 'after_delete')
+def _uncount_comment(mapper, connection, comment):
+    state = inspect(comment)
+    if _old_value(state, 'status') == Comment.STATUS_PUBLIC:
+        _adjust_count(connection, _old_value(state, 'entry_id'), -1)
@@ -0,0 +1,154 @@
+import zlib
+
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_accept_header
+
+from app import app
+
+try:
+    import brotli
+except ImportError:
+    # Responses are only gzipped without the brotli package.
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('application/javascript', 'application/json',
+                      'application/xml', 'image/svg+xml')
+
+def _is_compressible(content_type):
+    mimetype = content_type.split(';')[0].strip().lower()
+    return (mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES or
+            mimetype.endswith('+xml') or mimetype.endswith('+json'))
+
+class _GzipEncoder(object):
+    def __init__(self, level):
+        # wbits 31 writes the gzip header and trailer.
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def process(self, chunk):
+        # A sync flush sends out what was compressed so far, so that
+        # streamed pages reach the client chunk by chunk.
+        return (self.compressor.compress(chunk) +
+                self.compressor.flush(zlib.Z_SYNC_FLUSH))
+
+    def finish(self):
+        return self.compressor.flush()
+
+class _BrotliEncoder(object):
+    def __init__(self, quality):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def process(self, chunk):
+        return self.compressor.process(chunk) + self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+class CompressionMiddleware(object):
+    """
+    WSGI middleware compressing responses with brotli or gzip, whichever
+    the client prefers among those it accepts. Responses smaller than
+    min_size, already encoded, or of a type which does not compress well
+    are sent as they are.
+    """
+    def __init__(self, wsgi_app, min_size=1024, gzip_level=6,
+                 brotli_quality=4):
+        self.wsgi_app = wsgi_app
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def _encoding(self, environ):
+        if environ.get('REQUEST_METHOD') == 'HEAD':
+            return None
+        accepted = parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        # Highest quality first, brotli over gzip on a tie.
+        choices = [(accepted['gzip'], 0, 'gzip')]
+        if brotli is not None:
+            choices.append((accepted['br'], 1, 'br'))
+        quality, _, encoding = max(choices)
+        if quality:
+            return encoding
+
+    def _encoder(self, encoding):
+        if encoding == 'br':
+            return _BrotliEncoder(self.brotli_quality)
+        return _GzipEncoder(self.gzip_level)
+
+    def __call__(self, environ, start_response):
+        encoding = self._encoding(environ)
+        if encoding is None:
+            return self.wsgi_app(environ, start_response)
+
+        captured = []
+        def capture(status, headers, exc_info=None):
+            captured[:] = [status, headers, exc_info]
+            return lambda data: None
+        body = self.wsgi_app(environ, capture)
+        try:
+            chunks = iter(body)
+            # Hold back the start of the body until it is known whether
+            # it is worth compressing.
+            buffered, size, exhausted = [], 0, False
+            while size < self.min_size:
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    exhausted = True
+                    break
+                buffered.append(chunk)
+                size += len(chunk)
+
+            status, headers, exc_info = captured
+            headers = Headers(headers)
+            if (exhausted and size < self.min_size or
+                    'Content-Encoding' in headers or
+                    status.startswith(('204', '206', '304')) or
+                    not _is_compressible(headers.get('Content-Type', ''))):
+                start_response(status, headers.to_wsgi_list(), exc_info)
+                return self._passthrough(body, buffered, chunks)
+
+            headers.remove('Content-Length')
+            headers['Content-Encoding'] = encoding
+            vary = headers.get('Vary')
+            headers['Vary'] = ('{}, Accept-Encoding'.format(vary) if vary
+                               else 'Accept-Encoding')
+            etag = headers.get('ETag')
+            if etag and not etag.startswith('W/'):
+                # The compressed body is a different representation.
+                headers['ETag'] = 'W/' + etag
+            start_response(status, headers.to_wsgi_list(), exc_info)
+        except BaseException:
+            self._close(body)
+            raise
+        return self._compress(body, buffered, chunks, self._encoder(encoding))
+
+    def _close(self, body):
+        # Lets stream_with_context tear down the request context.
+        if hasattr(body, 'close'):
+            body.close()
+
+    def _passthrough(self, body, buffered, chunks):
+        try:
+            for chunk in buffered:
+                yield chunk
+            for chunk in chunks:
+                yield chunk
+        finally:
+            self._close(body)
+
+    def _compress(self, body, buffered, chunks, encoder):
+        try:
+            if buffered:
+                yield encoder.process(b''.join(buffered))
+            for chunk in chunks:
+                if chunk:
+                    yield encoder.process(chunk)
+            yield encoder.finish()
+        finally:
+            self._close(body)
+
+app.wsgi_app = CompressionMiddleware(
+    app.wsgi_app,
+    min_size=app.config['COMPRESSION_MIN_SIZE'],
+    gzip_level=app.config['COMPRESSION_GZIP_LEVEL'],
+    brotli_quality=app.config['COMPRESSION_BROTLI_QUALITY'])
@@ -5,5 +5,138 @@ class Configuration:
     DEBUG=True
     SECRET_KEY = 'savitar&zoom'
     SQLALCHEMY_DATABASE_URI = 'sqlite:///{}/blog.db'.format(APPLICATION_DIR)
+    # Connections kept open by each process, checkouts beyond
+    # SQLALCHEMY_POOL_SIZE + SQLALCHEMY_MAX_OVERFLOW wait up to
+    # SQLALCHEMY_POOL_TIMEOUT seconds for a free connection.
+    SQLALCHEMY_POOL_SIZE = 5
+    SQLALCHEMY_MAX_OVERFLOW = 10
+    SQLALCHEMY_POOL_TIMEOUT = 10
+    SQLALCHEMY_POOL_RECYCLE = 3600
+    # Run on every new SQLite connection, in this order. The write-ahead log
+    # lets readers carry on while a comment or an entry is being written,
+    # synchronous=NORMAL only syncs at checkpoints, which is safe in WAL
+    # mode, and writers wait busy_timeout milliseconds for the write lock
+    # instead of failing with "database is locked".
+    SQLITE_PRAGMAS = (
+        ('busy_timeout', 5000),
+        ('journal_mode', 'WAL'),
+        ('synchronous', 'NORMAL'),
+        ('mmap_size', 256 * 1024 * 1024),
+        ('cache_size', -16000),
+        ('temp_store', 'MEMORY'),
+    )
     STATIC_DIR = os.path.join(APPLICATION_DIR, 'static')
-    IMAGES_DIR = os.path.join(STATIC_DIR, 'images')
\ No newline at end of file
+    IMAGES_DIR = os.path.join(STATIC_DIR, 'images')
+    # Rendered-page cache for anonymous visitors.
+    # Use 'memory' for a per-process LRU, 'sqlite' to share across workers.
+    PAGE_CACHE_ENABLED = True
+    PAGE_CACHE_BACKEND = 'memory'
+    PAGE_CACHE_PATH = os.path.join(APPLICATION_DIR, 'page_cache.db')
+    PAGE_CACHE_MAX_ENTRIES = 1000
+    PAGE_CACHE_TTL = 300
+    # bcrypt work factor, existing hashes are upgraded on the next login.
+    BCRYPT_LOG_ROUNDS = 12
+    # Password hashing runs in a process pool, set the workers to 0 to hash
+    # in the request thread. Requests beyond the queue limit receive a 503.
+    PASSWORD_POOL_WORKERS = 2
+    PASSWORD_QUEUE_LIMIT = 8
+    PASSWORD_POOL_TIMEOUT = 10
+    # Logged-in users are cached between requests instead of being loaded
+    # from the database each time. Other processes see a change to a user
+    # after USER_CACHE_TTL, admin checks always read the database.
+    USER_CACHE_ENABLED = True
+    USER_CACHE_MAX_ENTRIES = 1000
+    USER_CACHE_TTL = 60
+    # Tags named in entry forms are cached between requests instead of being
+    # looked up each time.
+    TAG_CACHE_MAX_ENTRIES = 10000
+    TAG_CACHE_TTL = 300
+    # Read comment counts on list pages from Entry.comment_count rather than
+    # from a grouped COUNT over the comment table.
+    DENORMALIZED_COMMENT_COUNTS = True
+    # The tag index shows the TAG_CLOUD_SIZE most used tags, sized by their
+    # number of public entries, and below it every tag by name, a page at a
+    # time.
+    TAG_CLOUD_SIZE = 200
+    TAG_INDEX_PAGE_SIZE = 100
+    # The homepage is assembled from fragments rendered in the background,
+    # again as soon as a write in this process changes them, and every
+    # FRAGMENT_REFRESH_INTERVAL seconds for the writes of other processes.
+    HOMEPAGE_ENTRIES = 5
+    HOMEPAGE_TAGS = 20
+    HOMEPAGE_COMMENTS = 5
+    FRAGMENT_REFRESH_INTERVAL = 60
+    # Feeds list the FEED_SIZE newest public entries. Their documents are
+    # kept until an entry of theirs changes, or FEED_CACHE_TTL seconds for
+    # the writes of other processes.
+    FEED_SIZE = 20
+    # Scheme and host the feed URLs and entry ids are built on, such as
+    # 'https://blog.example.com'. Without it they follow the Host header of
+    # the request, and each host gets its own copy of the documents.
+    FEED_BASE_URL = None
+    FEED_CACHE_MAX_ENTRIES = 1000
+    FEED_CACHE_TTL = 300
+    # Per-request profiling: a Server-Timing header on every response and
+    # per-endpoint statistics at /admin/profiler/. PROFILER_SAMPLE_RATE runs
+    # cProfile on one request in N, 0 turns it off.
+    PROFILER_ENABLED = True
+    PROFILER_HISTORY = 1000
+    PROFILER_SLOW_STATEMENTS = 5
+    PROFILER_SAMPLE_RATE = 0
+    PROFILER_KEPT_PROFILES = 10
+    # Uploads larger than this are rejected with a 413.
+    MAX_CONTENT_LENGTH = 16 * 1024 * 1024
+    # Scaled-down copies of uploaded images, written by the job workers to
+    # IMAGES_DIR/<size>/.
+    IMAGE_SIZES = {'thumbnail': (150, 150), 'medium': (800, 800)}
+    # Background jobs, run by `manage.py run_workers`. A job still running
+    # after JOB_TIMEOUT seconds counts as a failed attempt, jobs are given up
+    # after JOB_MAX_ATTEMPTS.
+    JOB_QUEUE_PATH = os.path.join(APPLICATION_DIR, 'jobs.db')
+    JOB_MAX_ATTEMPTS = 3
+    JOB_TIMEOUT = 300
+    # Fingerprinted copies of the static files, built by
+    # `manage.py build_assets` and served with far-future cache headers.
+    # Brotli variants need the brotli package.
+    ASSETS_BUILD_DIR = os.path.join(STATIC_DIR, 'build')
+    ASSETS_MAX_AGE = 365 * 24 * 60 * 60
+    # Responses are compressed with brotli (when installed) or gzip, unless
+    # they are smaller than COMPRESSION_MIN_SIZE bytes.
+    COMPRESSION_MIN_SIZE = 1024
+    COMPRESSION_GZIP_LEVEL = 6
+    COMPRESSION_BROTLI_QUALITY = 4
+    # List pages are streamed as they render, STREAM_BUFFER_SIZE template
+    # events at a time, unless the page cache is about to store them.
+    STREAM_TEMPLATES = True
+    STREAM_BUFFER_SIZE = 5
+    # Comment submissions per client address: a burst of
+    # COMMENT_RATE_BURST, then COMMENT_RATE_LIMIT per COMMENT_RATE_PERIOD
+    # seconds. Use the 'sqlite' backend to share the limits across workers.
+    COMMENT_RATE_LIMIT_ENABLED = True
+    COMMENT_RATE_LIMIT = 5
+    COMMENT_RATE_PERIOD = 300
+    COMMENT_RATE_BURST = 3
+    RATE_LIMIT_BACKEND = 'memory'
+    RATE_LIMIT_PATH = os.path.join(APPLICATION_DIR, 'ratelimit.db')
+    # Addresses tracked at once, the least recently seen are dropped first.
+    RATE_LIMIT_MAX_KEYS = 10000
+    # Comments with more links than this, or from an address throttled in
+    # the last COMMENT_SPAM_WINDOW seconds, are stored as spam.
+    COMMENT_SPAM_MAX_LINKS = 2
+    COMMENT_SPAM_WINDOW = 3600
+
+class PostgresConfiguration(Configuration):
+    """
+    Engine profile for PostgreSQL, selected with
+    BLOG_CONFIGURATION=config.PostgresConfiguration and the database given
+    by DATABASE_URL. Needs the psycopg2 package. Full-text search is only
+    available on SQLite.
+    """
+    SQLALCHEMY_DATABASE_URI = os.environ.get(
+        'DATABASE_URL', 'postgresql://blog@localhost/blog')
+    SQLALCHEMY_POOL_SIZE = 10
+    SQLALCHEMY_MAX_OVERFLOW = 20
+    SQLALCHEMY_POOL_TIMEOUT = 10
+    # Below the idle timeouts of most proxies and PgBouncer setups.
+    SQLALCHEMY_POOL_RECYCLE = 1800
+    SQLITE_PRAGMAS = ()
@@ -1,36 +1,53 @@
-import os
-
 from flask.ext.login import login_required
 from flask import (Blueprint, flash, render_template, request, redirect, 
                    url_for, g)
-from werkzeug import secure_filename
+from sqlalchemy import exists
+from sqlalchemy.orm import joinedload, subqueryload
 
-from helpers import object_list
-from models import Entry, Tag
+import images
+import search
+import tag_stats
+from comments import public_comments
+from cache import (ENTRY_LIST, cached_page, depends_on, entry_key,
+                   tag_key)
+from helpers import conditional_response, make_etag, object_list
+from instrumentation import timed
+from models import Comment, Entry, Tag, entry_tags
 from entries.forms import EntryForm, ImageForm, CommentForm
 from app import db, app
 
 entries = Blueprint('entries', __name__,
                     template_folder='templates')
+
+# The detail page renders the author and every tag of the entry, load them
+# together with the entry instead of lazily from the template.
+DETAIL_LOAD_OPTIONS = (joinedload(Entry.author), subqueryload(Entry.tags))
                     
 def entry_list(template, query, **context):
     """
     Filter and return results based on the search inquiry.
     """
     query = filter_status_by_user(query)
-    valid_statuses = (Entry.STATUS_PUBLIC, Entry.STATUS_DRAFT)
-    query = query.filter(Entry.status.in_(valid_statuses))
+    # Page through entries newest first with a keyset on
+    # (created_timestamp, id), so deep pages never run COUNT or OFFSET.
+    cursor_columns = (Entry.created_timestamp, Entry.id)
     if request.args.get('q'):
-        search = request.args.get('q')
         # If 'q' is present, return only the entries that contain the
-        # search phrase in either the title or the body.
-        query = query.filter(
-            (Entry.title.contains(search))|
-            (Entry.body.contains(search)))
-    return object_list(template, query, **context)
+        # search phrase in either the title or the body, best matches first.
+        query = search.search(query, request.args.get('q'))
+        # Relevance ranking has no stable keyset, use numbered pages.
+        cursor_columns = None
+    return object_list(template, query, cursor_columns=cursor_columns,
+                       **context)
   
-def get_entry_or_404(slug, author=None):
-    query = Entry.query.filter(Entry.slug == slug)
+def entry_version(entry):
+    """
+    Identify the rendered version of an entry in a list of entries.
+    """
+    return (entry.id, entry.modified_timestamp, entry.comment_count)
+
+def get_entry_or_404(slug, author=None, options=()):
+    query = Entry.query.options(*options).filter(Entry.slug == slug)
     if author:
         query = query.filter(Entry.author == author)
     else:
@@ -45,15 +62,19 @@ def filter_status_by_user(query):
     if not g.user.is_authenticated:
         query = query.filter(Entry.status == Entry.STATUS_PUBLIC)
     else:
-        # Allow user to view their own drafts.
+        # Allow user to view their own drafts. The index on status cannot
+        # serve both statuses in created_timestamp order, and would have
+        # every visible entry sorted on each page. Comparing status + 0
+        # leaves it aside, so that lists walk ix_entry_created newest first
+        # and stop after a page.
         query = query.filter(
-            (Entry.status == Entry.STATUS_PUBLIC)|
+            (Entry.status + 0 == Entry.STATUS_PUBLIC)|
             # Only logged in user can view their own draft.
-            ((Entry.author == g.user) &
-             (Entry.status != Entry.STATUS_DELETED))
+            ((Entry.author_id == g.user.id) &
+             (Entry.status + 0 == Entry.STATUS_DRAFT))
         )
-    # Query = 'Give me all the public entries, or the undeleted entries for'
-    #         'which I am the author.'
+    # Query = 'Give me all the public entries, or the drafts for which I am'
+    #         'the author.'
     return query
          
 @entries.route('/image-upload/', methods=['GET', 'POST'])
@@ -61,24 +82,30 @@ def filter_status_by_user(query):
 def image_upload():
     if request.method == 'POST':
         form = ImageForm(request.form)
-        if form.validate():
+        with timed('forms'):
+            valid = form.validate()
+        if valid:
             # Flask stores the file in request.files dictionary
             image_file = request.files['file']
-            filename = os.path.join(
-                    # Generate correct path to static/images directory.
-                    app.config['IMAGES_DIR'],
-                    # Prevent malicious filenames
-                    secure_filename(image_file.filename))
-            # Save the uploaded file to disk.
-            image_file.save(filename)
-            flash('Saved "{}"'.format(os.path.basename(filename)), 
-                  'success')
-            return redirect(url_for('entries.index'))
+            try:
+                # Stored under the hash of its content, the smaller sizes
+                # are generated by a background job.
+                filename, is_new = images.save_upload(image_file)
+            except ValueError as exc:
+                flash(str(exc), 'danger')
+            else:
+                flash('{} "{}"'.format('Saved' if is_new else 'Already have',
+                                       filename),
+                      'success')
+                return redirect(url_for('entries.index'))
     else:
         form = ImageForm()
     return render_template('entries/image_upload.html', form=form)
+
 @entries.route('/')
+@cached_page
 def index():
+    depends_on(ENTRY_LIST)
     entries = Entry.query.order_by(Entry.created_timestamp.desc())
     # Return a paginated list of entries.
     return entry_list('entries/index.html', entries)
@@ -86,19 +113,41 @@ def index():
 @entries.route('/tags/')
 def tag_index():
     """
-    Render all the tags in the database.
+    Render the most used tags as a cloud weighted by their number of public
+    entries, alphabetically or, with sort=popular, most used first, followed
+    by a paginated list of all the tags.
     """
-    tags = Tag.query.order_by(Tag.name)
-    return object_list('entries/tag_index.html', tags)
+    sort = request.args.get('sort')
+    cloud = tag_stats.tag_cloud(app.config['TAG_CLOUD_SIZE'])
+    if sort != 'popular':
+        sort = 'name'
+        cloud.sort(key=lambda cloud_tag: (cloud_tag.tag.name or '').lower())
+    # The cloud stops at TAG_CLOUD_SIZE tags, the list keeps every tag
+    # reachable.
+    tags = Tag.query.order_by(Tag.name, Tag.id)
+    return object_list('entries/tag_index.html', tags,
+                       paginate_by=app.config['TAG_INDEX_PAGE_SIZE'],
+                       item_version=lambda tag: (tag.id, tag.name, tag.slug),
+                       page_version=[(tag.id, tag.name, tag.slug, entry_count)
+                                     for tag, entry_count, weight in cloud],
+                       tags=cloud, sort=sort)
 
 @entries.route('/tags/<slug>/')
+@cached_page
 def tag_detail(slug):
     """
     Render the entries matching a given tag.
     """
     tag = Tag.query.filter(Tag.slug == slug).first_or_404()
-    entries = tag.entries.order_by(Entry.created_timestamp.desc())
-    return entry_list('entries/tag_detail.html', entries, tag=tag)
+    depends_on(tag_key(tag.id))
+    # Entries are walked newest first along an index of the entry table,
+    # each checked against the pivot, so that a page stops once it is full
+    # rather than sorting every entry of the tag.
+    tagged = exists().where((entry_tags.c.entry_id == Entry.id) &
+                            (entry_tags.c.tag_id == tag.id))
+    entries = Entry.query.filter(tagged)
+    return entry_list('entries/tag_detail.html', entries, tag=tag,
+                      item_version=entry_version)
 
 # This view accepts both GET and POST requests.
 # Will get rid of the Method Not Allowed error when form is submitted.
@@ -113,7 +162,9 @@ def create():
         # Instanstiate the form and pass in the raw form data.
         form = EntryForm(request.form)
         # Check if the form is valid.
-        if form.validate():
+        with timed('forms'):
+            valid = form.validate()
+        if valid:
             # Manually set the author attribute during instatiation
             # of entry object.
             entry = form.save_entry(Entry(author=g.user))
@@ -129,16 +180,38 @@ def create():
     return render_template('entries/create.html', form=form)
 
 @entries.route('/<slug>/')
+@cached_page
 def detail(slug):
     """
     Render the contents of a single blog entry.
     """
     # Return a 404 if none matches.
-    entry = get_entry_or_404(slug)
+    entry = get_entry_or_404(slug, options=DETAIL_LOAD_OPTIONS)
+    # The sidebar lists the tag names, renaming a tag changes this page.
+    depends_on(entry_key(entry.id), *[tag_key(tag.id) for tag in entry.tags])
     # Pre-populate the entry_id hidden field with the value of the
     # requested entry.
     form = CommentForm(data={'entry_id': entry.id})
-    return render_template('entries/detail.html', entry=entry, form=form)
+
+    # The page changes with the entry, its tags, and its comments.
+    newest_comment = (db.session.query(db.func.max(Comment.modified_timestamp))
+                      .filter(Comment.entry_id == entry.id)
+                      .scalar())
+    etag = make_etag(entry.id, entry.modified_timestamp, newest_comment,
+                     entry.comment_count,
+                     [(tag.id, tag.name, tag.slug) for tag in entry.tags])
+    timestamps = [timestamp for timestamp in
+                  (entry.modified_timestamp, newest_comment) if timestamp]
+    last_modified = max(timestamps) if timestamps else None
+
+    def render():
+        # Embed the first page of comments instead of having comments.js
+        # fetch them from the API after the page has loaded.
+        comments, more_comments = public_comments(entry)
+        return render_template('entries/detail.html', entry=entry, form=form,
+                               comments=comments, more_comments=more_comments)
+
+    return conditional_response(render, etag, last_modified)
     
 @entries.route('/<slug>/edit/', methods=['GET', 'POST'])
 @login_required
@@ -151,7 +224,9 @@ def edit(slug):
         # When WTForms receives an obj parameter, it will attempt to 
         # pre-populate the form fields with values taken from obj.
         form = EntryForm(request.form, obj=entry)
-        if form.validate():
+        with timed('forms'):
+            valid = form.validate()
+        if valid:
             entry = form.save_entry(entry)
             db.session.add(entry)
             db.session.commit()
@@ -1,7 +1,9 @@
 import wtforms
 from wtforms.validators import DataRequired, Email, Optional, Length, URL
 
-from models import Entry, Tag
+from models import Entry
+from rendering import render_entry
+from tags import parse_tag_names, resolve_tags
 
 class TagField(wtforms.StringField):
     def _value(self):
@@ -15,22 +17,12 @@ class TagField(wtforms.StringField):
         return ''
         
     def get_tags_from_string(self, tag_string):
-        raw_tags = tag_string.split(',')
-        
-        # Filter out any empty tag names.
-        tag_names = [name.strip() for name in raw_tags if name.strip()]
-        
-        # Query the database and retrieve any tags already saved.
-        existing_tags = Tag.query.filter(Tag.name.in_(tag_names))
-        
-        # Determine which tag names are new.
-        new_names = set(tag_names) - set([tag.name for tag in existing_tags])
-        
-        # Create a list of unsaved Tag instances for the new tags.
-        new_tags = [Tag(name) for name in new_names]
-        
-        # Return all the existing tags + all the new, unsaved tags.
-        return list(existing_tags) + new_tags
+        """
+        Return the Tag instances named in the comma-separated string. Known
+        tags come from the tag cache, the others are looked up, or created,
+        together.
+        """
+        return resolve_tags(parse_tag_names(tag_string))
         
     def process_formdata(self, valuelist):
         """
@@ -68,10 +60,11 @@ class EntryForm(wtforms.Form):
     def save_entry(self, entry):
         """
         Populate the entry passed in with the form data, regenerate
-        the entry's slug based on the title.
+        the entry's slug based on the title and render its body.
         """
         self.populate_obj(entry)
         entry.generate_slug()
+        render_entry(entry)
         return entry
         
 class ImageForm(wtforms.Form):
@@ -0,0 +1,164 @@
+import collections, datetime, hashlib, json
+
+from flask import Markup, make_response, render_template, request, url_for
+from sqlalchemy.orm import joinedload, subqueryload
+
+from app import app
+from cache import (ENTRY_LIST, MemoryCache, author_key, invalidation_listeners,
+                   tag_key)
+from helpers import is_modified
+from models import Entry, Tag, User
+
+# A generated feed document, served as is until one of its entries changes.
+# last_modified is when it was generated, in UTC, for the Last-Modified
+# header. An entry dropping out of the feed does not move its newest
+# modification time forward, the generation time always does.
+FeedDocument = collections.namedtuple('FeedDocument',
+                                      'body etag last_modified')
+
+_MIMETYPES = {
+    'atom': 'application/atom+xml',
+    'json': 'application/feed+json',
+}
+
+# Feed documents keyed by feed and format, registered under the page cache
+# dependencies of their entries, so that only the feeds an entry change
+# affects are generated again.
+feed_cache = MemoryCache(
+    max_entries=app.config['FEED_CACHE_MAX_ENTRIES'],
+    default_ttl=app.config['FEED_CACHE_TTL'])
+
+invalidation_listeners.append(feed_cache.invalidate)
+
+def _timestamp(value):
+    # Timestamps are stored in local time, feeds need the UTC offset.
+    return value.astimezone().isoformat()
+
+def _base_url():
+    # The Host header is up to the client, it only decides the URLs when no
+    # base is configured, and the documents are then stored per host.
+    return (app.config['FEED_BASE_URL'] or request.host_url).rstrip('/')
+
+def _absolute_url(endpoint, **values):
+    return _base_url() + url_for(endpoint, **values)
+
+def _content_html(entry):
+    if entry.body_html is not None:
+        return entry.body_html
+    return str(Markup.escape(entry.body or ''))
+
+def _atom_document(feed):
+    return render_template('feeds/atom.xml', feed=feed,
+                           timestamp=_timestamp, content_html=_content_html)
+
+def _json_document(feed):
+    document = {
+        'version': 'https://jsonfeed.org/version/1.1',
+        'title': feed['title'],
+        'home_page_url': feed['home_page_url'],
+        'feed_url': feed['feed_url'],
+        'items': [],
+    }
+    for entry in feed['entries']:
+        item = {
+            'id': feed['entry_urls'][entry.id],
+            'url': feed['entry_urls'][entry.id],
+            'title': entry.title,
+            'content_html': _content_html(entry),
+            'summary': entry.tease,
+            'date_published': _timestamp(entry.created_timestamp),
+            'date_modified': _timestamp(entry.modified_timestamp),
+            'tags': [tag.name for tag in entry.tags],
+        }
+        if entry.author:
+            item['authors'] = [{'name': entry.author.name}]
+        document['items'].append(item)
+    return json.dumps(document, indent=2)
+
+_GENERATORS = {
+    'atom': _atom_document,
+    'json': _json_document,
+}
+
+def _generate(format, title, query, home_page_url, endpoint, **values):
+    """
+    Return the feed document of the newest public entries of query, and the
+    dependencies of the author names it shows.
+    """
+    entries = (query
+               .options(joinedload(Entry.author), subqueryload(Entry.tags))
+               .filter(Entry.status == Entry.STATUS_PUBLIC)
+               .order_by(Entry.created_timestamp.desc(), Entry.id.desc())
+               .limit(app.config['FEED_SIZE'])
+               .all())
+    updated = max([entry.modified_timestamp for entry in entries]
+                  or [None])
+    feed = {
+        'title': title,
+        'home_page_url': home_page_url,
+        'feed_url': _absolute_url(endpoint, format=format, **values),
+        'entries': entries,
+        'entry_urls': dict((entry.id, _absolute_url('entries.detail',
+                                                    slug=entry.slug))
+                           for entry in entries),
+        'updated': updated or datetime.datetime.now(),
+    }
+    body = _GENERATORS[format](feed)
+    etag = hashlib.sha1(body.encode('utf-8')).hexdigest()
+    dependencies = set(author_key(entry.author_id) for entry in entries
+                       if entry.author_id is not None)
+    # HTTP dates have no sub-second precision.
+    last_modified = datetime.datetime.utcnow().replace(microsecond=0)
+    return FeedDocument(body, etag, last_modified), dependencies
+
+def _feed_response(key, format, generate):
+    """
+    Serve the feed document stored under key, generating it when missing
+    with generate(format), which returns the document and its dependencies.
+    Answer 304 Not Modified when the reader already holds the document.
+    """
+    key = 'feed:{}/{}.{}'.format(_base_url(), key, format)
+    document = feed_cache.get(key)
+    if document is None:
+        document, dependencies = generate(format)
+        feed_cache.set(key, document, dependencies=dependencies)
+    if is_modified(document.etag, document.last_modified):
+        response = make_response(document.body)
+        response.mimetype = _MIMETYPES[format]
+    else:
+        response = app.response_class(status=304)
+    # The same document for every reader, logged in or not.
+    response.set_etag(document.etag)
+    response.last_modified = document.last_modified
+    return response
+
+@app.route('/feeds/entries.<any(atom, json):format>')
+def site_feed(format):
+    def generate(format):
+        document, dependencies = _generate(
+            format, 'My Blog', Entry.query, _absolute_url('entries.index'),
+            'site_feed')
+        return document, dependencies | {ENTRY_LIST}
+    return _feed_response('entries', format, generate)
+
+@app.route('/feeds/tags/<slug>.<any(atom, json):format>')
+def tag_feed(slug, format):
+    def generate(format):
+        tag = Tag.query.filter(Tag.slug == slug).first_or_404()
+        document, dependencies = _generate(
+            format, 'My Blog: {}'.format(tag.name), tag.entries,
+            _absolute_url('entries.tag_detail', slug=slug), 'tag_feed',
+            slug=slug)
+        return document, dependencies | {tag_key(tag.id)}
+    return _feed_response('tag:{}'.format(slug), format, generate)
+
+@app.route('/feeds/authors/<slug>.<any(atom, json):format>')
+def author_feed(slug, format):
+    # Authors have no page of their own, their feeds link to the entries.
+    def generate(format):
+        user = User.query.filter(User.slug == slug).first_or_404()
+        document, dependencies = _generate(
+            format, 'My Blog: {}'.format(user.name), user.entries,
+            _absolute_url('entries.index'), 'author_feed', slug=slug)
+        return document, dependencies | {author_key(user.id)}
+    return _feed_response('author:{}'.format(slug), format, generate)
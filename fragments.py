@@ -0,0 +1,143 @@
+import threading, time
+
+from flask import Markup, render_template
+from sqlalchemy.orm import contains_eager, joinedload
+
+from app import app
+from cache import ENTRY_LIST, TAG_LIST, invalidation_listeners
+from models import Comment, Entry
+from tag_stats import tag_cloud
+
+# Render functions and dependencies of the fragments by name, registered
+# with @fragment.
+_fragments = {}
+
+# Rendered HTML of the fragments by name. Replaced whole by the refresher,
+# never emptied, so that pages keep being served while it renders.
+_rendered = {}
+
+def fragment(name, dependencies):
+    """
+    Register the decorated function as the renderer of the named fragment,
+    to be rendered again when one of the page cache dependencies changes.
+    """
+    def decorator(fn):
+        _fragments[name] = (fn, frozenset(dependencies))
+        return fn
+    return decorator
+
+def render_fragment(name):
+    """
+    Render the named fragment and store it for the pages which include it.
+    """
+    fn, dependencies = _fragments[name]
+    html = _rendered[name] = Markup(fn())
+    return html
+
+class FragmentRefresher(object):
+    """
+    Thread rendering the fragments again in the background, those made
+    stale by the writes of this process as soon as they are committed, and
+    every fragment each interval seconds for the writes of other processes.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self._stale = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._last_full_refresh = time.time()
+
+    def start(self):
+        """
+        Start the thread unless it is running. A forked process has to
+        start its own.
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run,
+                                            name='fragment-refresher')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def mark_stale(self, names):
+        with self._lock:
+            self._stale.update(names)
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            # Local writes wake the thread early, they must not put off the
+            # full refresh which picks up the writes of other processes.
+            remaining = self._last_full_refresh + self.interval - time.time()
+            self._wakeup.wait(max(remaining, 0))
+            self._wakeup.clear()
+            with self._lock:
+                names, self._stale = self._stale, set()
+            if time.time() - self._last_full_refresh >= self.interval:
+                names = set(_fragments)
+                self._last_full_refresh = time.time()
+            for name in names:
+                self._refresh(name)
+
+    def _refresh(self, name):
+        try:
+            # A request context is needed to build the URLs.
+            with app.test_request_context('/'):
+                render_fragment(name)
+        except Exception:
+            app.logger.exception('Rendering fragment {} failed'.format(name))
+
+refresher = FragmentRefresher(app.config['FRAGMENT_REFRESH_INTERVAL'])
+
+def get_fragments(*names):
+    """
+    Return the HTML of the named fragments by name. Only fragments which
+    were never rendered in this process are rendered by the request.
+    """
+    refresher.start()
+    fragments = {}
+    for name in names:
+        html = _rendered.get(name)
+        if html is None:
+            html = render_fragment(name)
+        fragments[name] = html
+    return fragments
+
+def _mark_stale(dependencies):
+    names = [name for name, (fn, fragment_dependencies) in _fragments.items()
+             if fragment_dependencies & dependencies]
+    if names:
+        refresher.mark_stale(names)
+
+invalidation_listeners.append(_mark_stale)
+
+# Comment counts and tag statistics change along with the entries, the
+# entry list dependency covers comment and tag assignment changes too.
+@fragment('recent_entries', [ENTRY_LIST])
+def recent_entries():
+    entries = (Entry.query
+               .options(joinedload(Entry.author))
+               .filter(Entry.status == Entry.STATUS_PUBLIC)
+               .order_by(Entry.created_timestamp.desc(), Entry.id.desc())
+               .limit(app.config['HOMEPAGE_ENTRIES']))
+    return render_template('fragments/recent_entries.html', entries=entries)
+
+@fragment('popular_tags', [ENTRY_LIST, TAG_LIST])
+def popular_tags():
+    tags = tag_cloud(app.config['HOMEPAGE_TAGS'])
+    tags.sort(key=lambda cloud_tag: (cloud_tag.tag.name or '').lower())
+    return render_template('fragments/popular_tags.html', tags=tags)
+
+@fragment('recent_comments', [ENTRY_LIST])
+def recent_comments():
+    comments = (Comment.query
+                .join(Comment.entry)
+                .options(contains_eager(Comment.entry))
+                .filter(Comment.status == Comment.STATUS_PUBLIC)
+                .filter(Entry.status == Entry.STATUS_PUBLIC)
+                .order_by(Comment.id.desc())
+                .limit(app.config['HOMEPAGE_COMMENTS']))
+    return render_template('fragments/recent_comments.html',
+                           comments=comments)
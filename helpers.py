@@ -1,14 +1,214 @@
-from flask import render_template, request
+import datetime, hashlib
 
-def object_list(template_name, query, paginate_by=20, **context):
+from flask import (Response, abort, current_app, g, make_response,
+                   render_template, request, session, stream_with_context)
+from itsdangerous import BadSignature, URLSafeSerializer
+from sqlalchemy import and_, or_
+
+_DATETIME_FORMATS = ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S')
+
+class CursorPage(object):
+    """
+    A page of results fetched with keyset (cursor) pagination.
+    Mirrors the parts of Flask-SQLAlchemy's Pagination used by the templates,
+    but never counts the total number of rows.
+    """
+    cursor_mode = True
+
+    def __init__(self, items, has_prev, has_next, prev_cursor, next_cursor):
+        self.items = items
+        self.has_prev = has_prev
+        self.has_next = has_next
+        self.prev_cursor = prev_cursor
+        self.next_cursor = next_cursor
+
+def _serializer():
+    return URLSafeSerializer(current_app.secret_key, salt='page-cursor')
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return {'dt': value.isoformat()}
+    return value
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        for fmt in _DATETIME_FORMATS:
+            try:
+                return datetime.datetime.strptime(value['dt'], fmt)
+            except ValueError:
+                pass
+        raise ValueError('Invalid datetime in cursor.')
+    return value
+
+def encode_cursor(obj, columns, direction):
+    """
+    Return an opaque, signed token pointing at the position of obj.
+    """
+    key = [_encode_value(getattr(obj, column.key)) for column in columns]
+    return _serializer().dumps({'k': key, 'd': direction})
+
+def decode_cursor(token):
+    """
+    Return the (key, direction) pair stored in a cursor token.
+    """
+    data = _serializer().loads(token)
+    return [_decode_value(value) for value in data['k']], data['d']
+
+def _keyset_filter(columns, key, before):
+    """
+    Build the WHERE clause selecting the rows strictly after (before=True,
+    descending order) or strictly before the given key.
+    """
+    clauses = []
+    for i, column in enumerate(columns):
+        equal = [columns[j] == key[j] for j in range(i)]
+        if before:
+            bound = column < key[i]
+        else:
+            bound = column > key[i]
+        clauses.append(and_(*(equal + [bound])))
+    return or_(*clauses)
+
+def cursor_paginate(query, columns, per_page, cursor=None):
+    """
+    Return a CursorPage of the query, ordered by columns descending.
+    Only a single LIMIT query is issued, whatever the position in the list.
+    """
+    direction = 'next'
+    query = query.order_by(None)
+    if cursor:
+        try:
+            key, direction = decode_cursor(cursor)
+        except (BadSignature, ValueError, KeyError, TypeError):
+            abort(404)
+        if len(key) != len(columns):
+            abort(404)
+        query = query.filter(
+            _keyset_filter(columns, key, before=(direction == 'next')))
+
+    if direction == 'prev':
+        # Walk backwards and restore the descending order afterwards.
+        query = query.order_by(*[column.asc() for column in columns])
+    else:
+        query = query.order_by(*[column.desc() for column in columns])
+
+    # Fetch one extra row to find out whether there is another page.
+    items = query.limit(per_page + 1).all()
+    has_more = len(items) > per_page
+    items = items[:per_page]
+
+    if direction == 'prev':
+        items.reverse()
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = bool(cursor), has_more
+
+    prev_cursor = next_cursor = None
+    if items and has_prev:
+        prev_cursor = encode_cursor(items[0], columns, 'prev')
+    if items and has_next:
+        next_cursor = encode_cursor(items[-1], columns, 'next')
+    return CursorPage(items, has_prev, has_next, prev_cursor, next_cursor)
+
+def make_etag(*parts):
+    """
+    Return a strong ETag for a page built from the given parts.
+    Pages differ between visitors, so the current user is part of the tag.
+    """
+    user = g.user.get_id() if g.user.is_authenticated else None
+    return hashlib.sha1(repr((user,) + parts).encode('utf-8')).hexdigest()
+
+def is_modified(etag, last_modified=None):
+    """
+    Return False when the validators sent with the request match the current
+    version of the resource. If-None-Match takes precedence over
+    If-Modified-Since.
+    """
+    if request.headers.get('If-None-Match'):
+        # Weak comparison, the compression middleware weakens the ETags
+        # of the responses it compresses.
+        return not request.if_none_match.contains_weak(etag)
+    if last_modified and request.if_modified_since:
+        # HTTP dates have no sub-second precision.
+        return last_modified.replace(microsecond=0) > request.if_modified_since
+    return True
+
+def conditional_response(render, etag, last_modified=None):
+    """
+    Answer 304 Not Modified when the client already holds the current version
+    of the page, only calling render() to produce the body otherwise.
+    """
+    if '_flashes' in session:
+        # Flashed messages are shown once, never let the client reuse them.
+        return make_response(render())
+    if is_modified(etag, last_modified):
+        response = make_response(render())
+    else:
+        response = current_app.response_class(status=304)
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.vary.add('Cookie')
+    return response
+
+def stream_template(template_name, **context):
+    """
+    Render the template as a streamed response, sending each part of the
+    page as soon as it is rendered instead of the whole page at the end.
+    """
+    app = current_app._get_current_object()
+    app.update_template_context(context)
+    template = app.jinja_env.get_template(template_name)
+    stream = template.stream(context)
+    # Send the page in a few chunks rather than one per template statement.
+    stream.enable_buffering(app.config['STREAM_BUFFER_SIZE'])
+    return Response(stream_with_context(stream))
+
+def _page_state(object_list):
+    if getattr(object_list, 'cursor_mode', False):
+        return (object_list.prev_cursor, object_list.next_cursor)
+    return (object_list.page, object_list.pages)
+
+def object_list(template_name, query, paginate_by=20, cursor_columns=None,
+                item_version=None, page_version=None, **context):
     """
     Paginate lists of objects.
+    Pass cursor_columns, a sequence of columns forming a unique sort key, to
+    use keyset pagination instead of LIMIT/OFFSET pages.
+    Pass item_version, a function returning what identifies the rendered
+    version of an item, to answer conditional requests without rendering.
+    Pass page_version along with it when the page renders more than the
+    list, identifying the rest of the page.
     """
-    page = request.args.get('page')
-    if page and page.isdigit():
-        page = int(page)
+    if cursor_columns:
+        object_list = cursor_paginate(
+            query, cursor_columns, paginate_by, request.args.get('cursor'))
     else:
-        page = 1
-    
-    object_list = query.paginate(page, paginate_by)
-    return render_template(template_name, object_list=object_list, **context)
\ No newline at end of file
+        page = request.args.get('page')
+        if page and page.isdigit():
+            page = int(page)
+        else:
+            page = 1
+        object_list = query.paginate(page, paginate_by)
+
+    def render():
+        # The session is saved before a streamed body is sent, so a page
+        # which pops flashed messages has to be rendered up front. A page
+        # stored by the page cache is read whole anyway, see cached_page.
+        if (current_app.config['STREAM_TEMPLATES'] and
+                '_flashes' not in session and
+                not hasattr(g, 'cache_dependencies')):
+            return stream_template(
+                template_name, object_list=object_list, **context)
+        return render_template(
+            template_name, object_list=object_list, **context)
+
+    if item_version is None:
+        return render()
+    etag = make_etag(request.full_path, _page_state(object_list),
+                     [item_version(obj) for obj in object_list.items],
+                     page_version)
+    timestamps = [obj.modified_timestamp for obj in object_list.items
+                  if getattr(obj, 'modified_timestamp', None)]
+    return conditional_response(
+        render, etag, max(timestamps) if timestamps else None)
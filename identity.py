@@ -0,0 +1,58 @@
+from app import app, db, login_manager
+from cache import MemoryCache, author_key, invalidation_listeners
+from models import User
+
+# Detached User instances keyed by id. Each request merges its own copy into
+# the request session, which does not hit the database. A user is dropped
+# along with the pages of its author dependency, as soon as a change to it
+# is committed in this process.
+user_cache = MemoryCache(
+    max_entries=app.config['USER_CACHE_MAX_ENTRIES'],
+    default_ttl=app.config['USER_CACHE_TTL'])
+
+invalidation_listeners.append(user_cache.invalidate)
+
+def _load_detached_user(user_id):
+    """
+    Load a user in a throwaway session, so that the cached instance is never
+    modified or expired by the session of a request.
+    """
+    session = db.session.session_factory()
+    try:
+        user = session.query(User).get(user_id)
+        if user is not None:
+            session.expunge(user)
+        return user
+    finally:
+        session.close()
+
+def has_admin_access(user):
+    """
+    Check that the user is an active administrator according to the
+    database. Changes committed by other processes reach their identity
+    caches only after USER_CACHE_TTL, permission checks do not wait for it.
+    """
+    if not user.is_authenticated:
+        return False
+    row = (db.session.query(User.admin, User.active)
+           .filter(User.id == user.id)
+           .first())
+    return row is not None and bool(row.admin) and bool(row.active)
+
+# Tell Flask-login how to determine which user is logged in.
+@login_manager.user_loader
+def _user_loader(user_id):
+    """
+    Accept the id stored in the session and return a User
+    object from the database, or from the identity cache.
+    """
+    user_id = int(user_id)
+    if not app.config['USER_CACHE_ENABLED']:
+        return User.query.get(user_id)
+    user = user_cache.get(user_id)
+    if user is None:
+        user = _load_detached_user(user_id)
+        if user is None:
+            return None
+        user_cache.set(user_id, user, dependencies=[author_key(user_id)])
+    return db.session.merge(user, load=False)
@@ -0,0 +1,80 @@
+import hashlib, os, tempfile
+
+from PIL import Image
+
+from app import app
+from jobs import job, queue
+
+ALLOWED_EXTENSIONS = ('gif', 'jpeg', 'jpg', 'png')
+
+# Uploads are copied to disk this many bytes at a time.
+CHUNK_SIZE = 64 * 1024
+
+def image_extension(filename):
+    """
+    Return the lowercased extension of an image filename, or None when it
+    is not an allowed image type.
+    """
+    extension = os.path.splitext(filename)[1].lstrip('.').lower()
+    if extension in ALLOWED_EXTENSIONS:
+        return extension
+
+def derived_path(size, name):
+    return os.path.join(app.config['IMAGES_DIR'], size, name)
+
+def save_upload(file_storage):
+    """
+    Copy the uploaded file into IMAGES_DIR under the hash of its content,
+    chunk by chunk, and queue the generation of its smaller sizes. Uploading
+    the same image twice stores it once. Returns the stored filename and
+    whether it is new.
+    """
+    extension = image_extension(file_storage.filename or '')
+    if extension is None:
+        raise ValueError('Only {} images can be uploaded.'.format(
+            ', '.join(ALLOWED_EXTENSIONS)))
+    images_dir = app.config['IMAGES_DIR']
+    os.makedirs(images_dir, exist_ok=True)
+
+    digest = hashlib.sha256()
+    # Written next to its final location, so that the rename is atomic.
+    fd, temp_path = tempfile.mkstemp(dir=images_dir, suffix='.upload')
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            while True:
+                chunk = file_storage.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                temp_file.write(chunk)
+        name = '{}.{}'.format(digest.hexdigest()[:32], extension)
+        path = os.path.join(images_dir, name)
+        if os.path.exists(path):
+            os.remove(temp_path)
+            return name, False
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    queue.enqueue('resize_image', filename=name)
+    return name, True
+
+@job('resize_image')
+def resize_image(filename):
+    """
+    Write a scaled-down copy of the image for every size in IMAGE_SIZES.
+    """
+    path = os.path.join(app.config['IMAGES_DIR'], filename)
+    with Image.open(path) as image:
+        for size, dimensions in app.config['IMAGE_SIZES'].items():
+            path = derived_path(size, filename)
+            if os.path.exists(path):
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            resized = image.copy()
+            resized.thumbnail(dimensions, Image.ANTIALIAS)
+            temp_path = '{}.{}.tmp'.format(path, os.getpid())
+            resized.save(temp_path, format=image.format)
+            os.replace(temp_path, path)
@@ -0,0 +1,259 @@
+import cProfile, io, pstats, random, threading, time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import app
+
+# Counters opened with count_queries(), innermost last.
+_active_counters = []
+
+class QueryCounter(object):
+    """
+    Count the SQL statements executed while the counter is active.
+    """
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+@contextmanager
+def count_queries():
+    """
+    Record every statement executed inside the with block, e.g.:
+
+        with count_queries() as counter:
+            client.get('/entries/')
+        assert counter.count <= 3
+    """
+    counter = QueryCounter()
+    _active_counters.append(counter)
+    try:
+        yield counter
+    finally:
+        _active_counters.remove(counter)
+
+def get_query_count():
+    """
+    Return the number of statements executed by the current request.
+    """
+    return getattr(g, 'query_count', 0)
+
+class RequestProfile(object):
+    """
+    Where the time of a single request went: SQL statements, templates and
+    any section measured with timed(). Durations are in seconds.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.query_time = 0.0
+        # (duration, statement) pairs, longest first.
+        self.slowest = []
+        self.sections = defaultdict(float)
+
+    def add_query(self, statement, duration):
+        self.query_time += duration
+        self.slowest.append((duration, statement))
+        self.slowest.sort(key=lambda item: item[0], reverse=True)
+        del self.slowest[app.config['PROFILER_SLOW_STATEMENTS']:]
+
+def _current_profile():
+    if has_request_context():
+        return getattr(g, 'profile', None)
+
+@contextmanager
+def timed(name):
+    """
+    Add the time spent in the with block to the named section of the
+    current request profile, reported in the Server-Timing header.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile = _current_profile()
+        if profile is not None:
+            profile.sections[name] += time.perf_counter() - started
+
+class TimedTemplate(Template):
+    """
+    Template which adds its render time to the "tpl" section. Included and
+    extended templates are rendered by their parent and are not counted
+    twice.
+    """
+    def render(self, *args, **kwargs):
+        with timed('tpl'):
+            return super().render(*args, **kwargs)
+
+    def generate(self, *args, **kwargs):
+        # Streamed templates are timed chunk by chunk.
+        chunks = super().generate(*args, **kwargs)
+        while True:
+            with timed('tpl'):
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    return
+            yield chunk
+
+# Has to be set before the first template is loaded.
+app.jinja_env.template_class = TimedTemplate
+
+# Histogram buckets for the request duration, in milliseconds.
+HISTOGRAM_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, float('inf'))
+
+class EndpointStats(object):
+    """
+    Rolling window of the most recent requests of an endpoint.
+    """
+    def __init__(self, size):
+        # (total ms, sql ms, query count, template ms) per request.
+        self.samples = deque(maxlen=size)
+        # Longest duration seen for each of the slowest statements.
+        self.slowest = {}
+
+    def add(self, total, sql, queries, template, slowest):
+        self.samples.append((total, sql, queries, template))
+        for duration, statement in slowest:
+            if duration > self.slowest.get(statement, 0):
+                self.slowest[statement] = duration
+        kept = sorted(self.slowest.items(), key=lambda item: item[1],
+                      reverse=True)[:app.config['PROFILER_SLOW_STATEMENTS']]
+        self.slowest = dict(kept)
+
+    def summary(self):
+        totals = sorted(sample[0] for sample in self.samples)
+        count = len(totals)
+        percentile = lambda fraction: totals[
+            max(0, int(round(fraction * count)) - 1)]
+        histogram = [0] * len(HISTOGRAM_BUCKETS)
+        for total in totals:
+            for i, bound in enumerate(HISTOGRAM_BUCKETS):
+                if total <= bound:
+                    histogram[i] += 1
+                    break
+        mean = lambda index: sum(
+            sample[index] for sample in self.samples) / count
+        return {
+            'count': count,
+            'p50': percentile(0.50),
+            'p95': percentile(0.95),
+            'p99': percentile(0.99),
+            'sql_ms': mean(1),
+            'queries': mean(2),
+            'template_ms': mean(3),
+            'histogram': histogram,
+            'slowest': sorted(((duration, statement) for statement, duration
+                               in self.slowest.items()), reverse=True),
+        }
+
+class Profiler(object):
+    """
+    Per-endpoint request statistics and the output of sampled cProfile
+    runs, kept in memory for the admin profiler view.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        self.profiles = deque(maxlen=app.config['PROFILER_KEPT_PROFILES'])
+
+    def record(self, endpoint, profile, total):
+        slowest = [(duration * 1000, statement)
+                   for duration, statement in profile.slowest]
+        with self.lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = EndpointStats(
+                    app.config['PROFILER_HISTORY'])
+            stats.add(total * 1000, profile.query_time * 1000,
+                      get_query_count(), profile.sections['tpl'] * 1000,
+                      slowest)
+
+    def add_profile(self, path, stats_text):
+        with self.lock:
+            self.profiles.appendleft((path, stats_text))
+
+    def summaries(self):
+        with self.lock:
+            return sorted((endpoint, stats.summary())
+                          for endpoint, stats in self.endpoints.items())
+
+    def reset(self):
+        with self.lock:
+            self.endpoints.clear()
+            self.profiles.clear()
+
+profiler = Profiler()
+
+@app.before_request
+def _start_profile():
+    if not app.config['PROFILER_ENABLED']:
+        return
+    g.profile = RequestProfile()
+    rate = app.config['PROFILER_SAMPLE_RATE']
+    if rate and random.randrange(rate) == 0:
+        g.cprofile = cProfile.Profile()
+        g.cprofile.enable()
+
+def _server_timing(profile, total, streamed=False):
+    metrics = ['sql;dur={:.2f};desc="{} queries"'.format(
+        profile.query_time * 1000, get_query_count())]
+    for name, duration in sorted(profile.sections.items()):
+        metrics.append('{};dur={:.2f}'.format(name, duration * 1000))
+    metrics.append('app;dur={:.2f}'.format(total * 1000))
+    if streamed:
+        # The headers leave before the body is rendered.
+        metrics.append('stream;desc="body not included"')
+    return ', '.join(metrics)
+
+@app.after_request
+def _finish_profile(response):
+    profile = _current_profile()
+    if profile is not None:
+        total = time.perf_counter() - profile.started
+        response.headers['Server-Timing'] = _server_timing(
+            profile, total, response.is_streamed)
+    return response
+
+# The request context of a streamed page is torn down once its body has
+# been sent, so the statistics cover the rendering of the whole page. The
+# teardown also runs when the view raises, unlike after_request.
+@app.teardown_request
+def _record_profile(exception):
+    cprofile = getattr(g, 'cprofile', None)
+    if cprofile is not None:
+        cprofile.disable()
+        g.cprofile = None
+        output = io.StringIO()
+        pstats.Stats(cprofile, stream=output).sort_stats(
+            'cumulative').print_stats(30)
+        profiler.add_profile(request.full_path, output.getvalue())
+    profile = _current_profile()
+    if profile is not None:
+        g.profile = None
+        total = time.perf_counter() - profile.started
+        profiler.record(request.endpoint or '(not found)', profile, total)
+
+# Listen on the Engine class so that the counter works whichever engine
+# Flask-SQLAlchemy ends up creating.
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.query_count = getattr(g, 'query_count', 0) + 1
+    for counter in _active_counters:
+        counter.count += 1
+        counter.statements.append(statement)
+    # Kept on the execution context, which goes away with the statement
+    # when it raises and after_cursor_execute never runs.
+    if context is not None:
+        context._query_started = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _time_query(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_query_started', None)
+    profile = _current_profile()
+    if profile is not None and started is not None:
+        profile.add_query(statement, time.perf_counter() - started)
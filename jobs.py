@@ -0,0 +1,173 @@
+import contextlib, json, os, socket, sqlite3, threading, time, traceback
+
+from app import app
+
+# Job handlers by name, registered with @job.
+_handlers = {}
+
+def job(name):
+    """
+    Register the decorated function as the handler of the named job. It is
+    called with the keyword arguments given to enqueue.
+    """
+    def decorator(fn):
+        _handlers[name] = fn
+        return fn
+    return decorator
+
+class JobQueue(object):
+    """
+    Queue of jobs stored in a local SQLite file, shared by the web processes
+    which enqueue jobs and the worker processes started with
+    `manage.py run_workers`.
+    """
+    def __init__(self, path, max_attempts=3, timeout=300):
+        self.path = path
+        self.max_attempts = max_attempts
+        # Running jobs older than this are assumed to belong to a dead
+        # worker and are queued again.
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared between threads. The file is
+        # only created once a job is enqueued or looked for, not on import.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Transactions are opened explicitly, see _transaction.
+            conn = sqlite3.connect(self.path, timeout=5,
+                                   isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            with conn:
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS job ('
+                    'id INTEGER PRIMARY KEY, name TEXT, arguments TEXT, '
+                    "status TEXT DEFAULT 'queued', "
+                    'attempts INTEGER DEFAULT 0, run_after REAL, '
+                    'claimed_by TEXT, claimed_at REAL, error TEXT)')
+                conn.execute(
+                    'CREATE INDEX IF NOT EXISTS job_status_run_after '
+                    'ON job (status, run_after)')
+            self._local.conn = conn
+        return conn
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """
+        Run the block in a transaction holding the write lock from its
+        start, so that what it reads cannot change before it writes. The
+        sqlite3 module would only begin the transaction at the first
+        write.
+        """
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+
+    def enqueue(self, job_name, **arguments):
+        """
+        Add a job to the queue and return its id.
+        """
+        with self._connection() as conn:
+            return conn.execute(
+                'INSERT INTO job (name, arguments, run_after) '
+                'VALUES (?, ?, ?)',
+                (job_name, json.dumps(arguments), time.time())).lastrowid
+
+    def claim(self, worker):
+        """
+        Mark the oldest runnable job as running by the worker and return
+        its (id, name, arguments), or None when the queue is empty.
+        """
+        now = time.time()
+        # The write lock, taken before the job is looked for, keeps two
+        # workers from claiming the same job.
+        with self._transaction() as conn:
+            # A job which hangs or kills its worker counts as a failed
+            # attempt, so that it is not retried forever.
+            stale = conn.execute(
+                "SELECT id, attempts, claimed_by FROM job "
+                "WHERE status = 'running' AND claimed_at < ?",
+                (now - self.timeout,)).fetchall()
+            for job_id, attempts, claimed_by in stale:
+                self._retry_or_fail(
+                    conn, job_id, attempts,
+                    'Not finished by {} within {} seconds.'.format(
+                        claimed_by, self.timeout))
+            row = conn.execute(
+                "SELECT id, name, arguments FROM job "
+                "WHERE status = 'queued' AND run_after <= ? "
+                "ORDER BY id LIMIT 1", (now,)).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE job SET status = 'running', claimed_by = ?, "
+                "claimed_at = ?, attempts = attempts + 1 WHERE id = ?",
+                (worker, now, row[0]))
+        return row[0], row[1], json.loads(row[2])
+
+    def finish(self, job_id):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM job WHERE id = ?', (job_id,))
+
+    def fail(self, job_id, error):
+        """
+        Queue the job again with an exponential backoff, or mark it as
+        failed once it has run max_attempts times.
+        """
+        with self._transaction() as conn:
+            attempts, = conn.execute(
+                'SELECT attempts FROM job WHERE id = ?', (job_id,)).fetchone()
+            self._retry_or_fail(conn, job_id, attempts, error)
+
+    def _retry_or_fail(self, conn, job_id, attempts, error):
+        status = 'failed' if attempts >= self.max_attempts else 'queued'
+        conn.execute(
+            'UPDATE job SET status = ?, error = ?, run_after = ? '
+            'WHERE id = ?',
+            (status, error, time.time() + 2 ** attempts, job_id))
+
+    def counts(self):
+        """
+        Return the number of jobs in each status.
+        """
+        return dict(self._connection().execute(
+            'SELECT status, COUNT(*) FROM job GROUP BY status'))
+
+    def run_worker(self, burst=False, poll_interval=1.0):
+        """
+        Run jobs until interrupted, or until the queue is empty with burst.
+        Returns the number of jobs run.
+        """
+        worker = '{}:{}'.format(socket.gethostname(), os.getpid())
+        count = 0
+        while True:
+            claimed = self.claim(worker)
+            if claimed is None:
+                if burst:
+                    return count
+                time.sleep(poll_interval)
+                continue
+            job_id, name, arguments = claimed
+            try:
+                handler = _handlers[name]
+                with app.app_context():
+                    handler(**arguments)
+            except Exception:
+                app.logger.exception('Job {} ({}) failed'.format(job_id, name))
+                self.fail(job_id, traceback.format_exc())
+            else:
+                self.finish(job_id)
+            count += 1
+
+def make_queue(config):
+    return JobQueue(config['JOB_QUEUE_PATH'],
+                    max_attempts=config['JOB_MAX_ATTEMPTS'],
+                    timeout=config['JOB_TIMEOUT'])
+
+queue = make_queue(app.config)
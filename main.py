@@ -6,7 +6,19 @@ from app import app, db
 # Import admin after app.
 import admin
 import api
+import assets
+import cache
+import comments
+import compression
+import feeds
+import fragments
+import identity
+import instrumentation
 import models
+import rendering
+import search
+import tag_stats
+import tags
 import views
 
 from entries.blueprint import entries
@@ -1,5 +1,136 @@
+import multiprocessing, sys
+
 from app import manager
 from main import *
 
+import bulk
+import jobs
+
+def clear_page_cache():
+    # Commands run in a process of their own, they only reach the pages
+    # of the running workers through the shared sqlite backend.
+    cache.page_cache.clear()
+    if app.config['PAGE_CACHE_BACKEND'] != 'sqlite':
+        sys.stderr.write(
+            'The memory page cache of running workers is not cleared, their '
+            'pages expire within {} seconds or on restart.\n'.format(
+                app.config['PAGE_CACHE_TTL']))
+
+@manager.command
+def rebuild_search_index():
+    """
+    Rebuild the full-text search index from scratch.
+    """
+    with db.engine.begin() as connection:
+        count = search.rebuild_index(connection)
+    if count is None:
+        print('Full-text search is not supported on {}, nothing to '
+              'rebuild.'.format(db.engine.dialect.name))
+    else:
+        print('Indexed {} entries.'.format(count))
+
+@manager.command
+def rebuild_comment_counts():
+    """
+    Recompute the denormalized comment count of every entry.
+    """
+    with db.engine.begin() as connection:
+        comments.refresh_comment_counts(connection)
+    print('Comment counts rebuilt.')
+
+@manager.command
+def rebuild_tag_stats():
+    """
+    Recompute the public entry count of every tag.
+    """
+    with db.engine.begin() as connection:
+        tag_stats.rebuild_tag_stats(connection)
+    print('Tag statistics rebuilt.')
+
+@manager.option('-a', '--all', dest='all_entries', action='store_true',
+                help='Render every entry, not only the outdated ones.')
+@manager.option('-w', '--workers', dest='workers', type=int, default=None,
+                help='Number of rendering processes.')
+def render_entries(all_entries=False, workers=None):
+    """
+    Render entry bodies to HTML with the current renderer version.
+    """
+    with db.engine.begin() as connection:
+        count = rendering.rerender_entries(connection, all_entries, workers)
+    # Rendered pages hold the previous HTML.
+    clear_page_cache()
+    print('Rendered {} entries.'.format(count))
+
+@manager.option('path', help='File to write, - for standard output.')
+def export_data(path):
+    """
+    Export users, tags, entries and comments as JSON lines.
+    """
+    with db.engine.connect() as connection:
+        if path == '-':
+            count = bulk.export_jsonl(connection, sys.stdout)
+        else:
+            with open(path, 'w') as fileobj:
+                count = bulk.export_jsonl(connection, fileobj)
+    sys.stderr.write('Exported {} records.\n'.format(count))
+
+@manager.option('path', help='File to read, - for standard input.')
+@manager.option('-b', '--batch-size', dest='batch_size', type=int,
+                default=1000, help='Number of records per transaction.')
+@manager.option('-w', '--workers', dest='workers', type=int, default=None,
+                help='Number of rendering processes.')
+def import_data(path, batch_size=1000, workers=None):
+    """
+    Import JSON lines written by export_data. Existing rows are kept.
+    """
+    with db.engine.connect() as connection:
+        if path == '-':
+            counts = bulk.import_jsonl(connection, sys.stdin, batch_size)
+        else:
+            with open(path) as fileobj:
+                counts = bulk.import_jsonl(connection, fileobj, batch_size)
+    # Rows inserted in bulk skip the mapper events, so the derived data is
+    # brought up to date afterwards.
+    with db.engine.begin() as connection:
+        rendering.rerender_entries(connection, workers=workers,
+                                   keep_timestamps=True)
+        comments.refresh_comment_counts(connection)
+        tag_stats.rebuild_tag_stats(connection)
+        search.rebuild_index(connection)
+    clear_page_cache()
+    for record_type in bulk.RECORD_TYPES:
+        print('Processed {} {} records.'.format(counts[record_type],
+                                                record_type))
+
+@manager.command
+def build_assets():
+    """
+    Fingerprint and precompress the static files, run before deploying.
+    """
+    count = assets.build_assets()
+    # Cached pages link to the previous copies.
+    clear_page_cache()
+    print('Built {} assets.'.format(count))
+
+def _run_worker(burst):
+    # Each process opens its own connection to the queue.
+    jobs.make_queue(app.config).run_worker(burst=burst)
+
+@manager.option('-w', '--workers', dest='workers', type=int, default=2,
+                help='Number of worker processes.')
+@manager.option('-b', '--burst', dest='burst', action='store_true',
+                help='Exit once the queue is empty.')
+def run_workers(workers=2, burst=False):
+    """
+    Run background jobs, such as resizing uploaded images.
+    """
+    processes = [multiprocessing.Process(target=_run_worker, args=(burst,))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    print('Jobs left: {}'.format(jobs.queue.counts()))
+
 if __name__ == '__main__':
-    manager.run()
\ No newline at end of file
+    manager.run()
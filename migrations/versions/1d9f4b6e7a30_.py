@@ -0,0 +1,33 @@
+"""Store the rendered HTML and teaser of entries.
+
+Run "python manage.py render_entries" after upgrading to fill the columns.
+
+Revision ID: 1d9f4b6e7a30
+Revises: e5a07f3b8c21
+Create Date: 2026-10-18 15:48:19.207764
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1d9f4b6e7a30'
+down_revision = 'e5a07f3b8c21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('entry', sa.Column('body_html', sa.Text(), nullable=True))
+    op.add_column('entry', sa.Column('tease_text', sa.String(length=100),
+                                     nullable=True))
+    op.add_column('entry', sa.Column('render_version', sa.Integer(),
+                                     nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('entry') as batch_op:
+        batch_op.drop_column('render_version')
+        batch_op.drop_column('tease_text')
+        batch_op.drop_column('body_html')
@@ -0,0 +1,34 @@
+"""Add the entry_search full-text index.
+
+Revision ID: 3f1c9a7d2b64
+Revises: a4561f22487b
+Create Date: 2026-10-18 09:12:41.118203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c9a7d2b64'
+down_revision = 'a4561f22487b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'sqlite':
+        return
+    op.execute('CREATE VIRTUAL TABLE IF NOT EXISTS entry_search '
+               'USING fts5(title, body)')
+    # Index every entry which has not been soft-deleted.
+    op.execute('INSERT INTO entry_search (rowid, title, body) '
+               'SELECT id, title, body FROM entry WHERE status IN (0, 1)')
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'sqlite':
+        return
+    op.execute('DROP TABLE IF EXISTS entry_search')
@@ -0,0 +1,27 @@
+"""Add the modification time of comments.
+
+Revision ID: 4e2b7d9c1a56
+Revises: 9c3e7a5f1b28
+Create Date: 2026-10-18 20:41:37.215904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4e2b7d9c1a56'
+down_revision = '9c3e7a5f1b28'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('comment', sa.Column('modified_timestamp', sa.DateTime(),
+                                       nullable=True))
+    op.execute('UPDATE comment SET modified_timestamp = created_timestamp')
+
+
+def downgrade():
+    with op.batch_alter_table('comment') as batch_op:
+        batch_op.drop_column('modified_timestamp')
@@ -0,0 +1,30 @@
+"""Add the denormalized entry.comment_count column.
+
+Revision ID: 7b2e5d0c9a13
+Revises: 3f1c9a7d2b64
+Create Date: 2026-10-18 11:40:07.532810
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b2e5d0c9a13'
+down_revision = '3f1c9a7d2b64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('entry', sa.Column('comment_count', sa.Integer(),
+                                     server_default='0', nullable=False))
+    # Count the public comments (status 1) already posted.
+    op.execute('UPDATE entry SET comment_count = ('
+               'SELECT count(comment.id) FROM comment '
+               'WHERE comment.entry_id = entry.id AND comment.status = 1)')
+
+
+def downgrade():
+    with op.batch_alter_table('entry') as batch_op:
+        batch_op.drop_column('comment_count')
@@ -0,0 +1,42 @@
+"""Add the tag_stats table of public entry counts per tag.
+
+Revision ID: 9c3e7a5f1b28
+Revises: 1d9f4b6e7a30
+Create Date: 2026-10-18 19:02:13.480516
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c3e7a5f1b28'
+down_revision = '1d9f4b6e7a30'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('tag_stats',
+    sa.Column('tag_id', sa.Integer(), nullable=False),
+    sa.Column('entry_count', sa.Integer(), server_default='0',
+              nullable=False),
+    sa.Column('last_used', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['tag_id'], ['tag.id'], ),
+    sa.PrimaryKeyConstraint('tag_id')
+    )
+    op.create_index('ix_tag_stats_entry_count', 'tag_stats',
+                    ['entry_count', 'tag_id'], unique=False)
+    # Count the public entries (status 0) of the existing tags.
+    op.execute('INSERT INTO tag_stats (tag_id, entry_count, last_used) '
+               'SELECT tag.id, count(entry.id), max(entry.created_timestamp) '
+               'FROM tag LEFT OUTER JOIN entry_tags '
+               'ON entry_tags.tag_id = tag.id '
+               'LEFT OUTER JOIN entry ON entry.id = entry_tags.entry_id '
+               'AND entry.status = 0 '
+               'GROUP BY tag.id')
+
+
+def downgrade():
+    op.drop_index('ix_tag_stats_entry_count', table_name='tag_stats')
+    op.drop_table('tag_stats')
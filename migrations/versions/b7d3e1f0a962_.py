@@ -0,0 +1,57 @@
+"""Merge tags sharing a name and make tag names unique.
+
+Revision ID: b7d3e1f0a962
+Revises: 4e2b7d9c1a56
+Create Date: 2026-10-18 22:05:13.480127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d3e1f0a962'
+down_revision = '4e2b7d9c1a56'
+branch_labels = None
+depends_on = None
+
+# The oldest tag of each name is kept, the others are merged into it.
+KEPT = ('SELECT min(id) AS id, name FROM tag WHERE name IS NOT NULL '
+        'GROUP BY name')
+DUPLICATES = ('SELECT id FROM tag WHERE name IS NOT NULL '
+              'AND id NOT IN (SELECT min(id) FROM tag '
+              'WHERE name IS NOT NULL GROUP BY name)')
+
+
+def upgrade():
+    # Move the entries of the duplicates to the kept tag, unless the entry
+    # has it already.
+    op.execute('INSERT INTO entry_tags (tag_id, entry_id) '
+               'SELECT DISTINCT kept.id, entry_tags.entry_id '
+               'FROM entry_tags JOIN tag ON tag.id = entry_tags.tag_id '
+               'JOIN ({}) AS kept ON kept.name = tag.name '
+               'WHERE tag.id != kept.id AND NOT EXISTS ('
+               'SELECT 1 FROM entry_tags AS existing '
+               'WHERE existing.tag_id = kept.id '
+               'AND existing.entry_id = entry_tags.entry_id)'.format(KEPT))
+    op.execute('DELETE FROM entry_tags WHERE tag_id IN ({})'.format(
+        DUPLICATES))
+    op.execute('DELETE FROM tag_stats WHERE tag_id IN ({})'.format(
+        DUPLICATES))
+    op.execute('DELETE FROM tag WHERE id IN ({})'.format(DUPLICATES))
+    # Count the public entries (status 0) of the tags again.
+    op.execute('DELETE FROM tag_stats')
+    op.execute('INSERT INTO tag_stats (tag_id, entry_count, last_used) '
+               'SELECT tag.id, count(entry.id), max(entry.created_timestamp) '
+               'FROM tag LEFT OUTER JOIN entry_tags '
+               'ON entry_tags.tag_id = tag.id '
+               'LEFT OUTER JOIN entry ON entry.id = entry_tags.entry_id '
+               'AND entry.status = 0 '
+               'GROUP BY tag.id')
+    op.drop_index('ix_tag_name', table_name='tag')
+    op.create_index('ix_tag_name', 'tag', ['name'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_tag_name', table_name='tag')
+    op.create_index('ix_tag_name', 'tag', ['name'], unique=False)
@@ -0,0 +1,39 @@
+"""Store the gravatar email hash of comments.
+
+Revision ID: c41d8e6f2a57
+Revises: 7b2e5d0c9a13
+Create Date: 2026-10-18 13:05:52.904417
+
+"""
+import hashlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41d8e6f2a57'
+down_revision = '7b2e5d0c9a13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('comment', sa.Column('email_hash', sa.String(length=32),
+                                       nullable=True))
+    comment = sa.table('comment',
+                       sa.column('id', sa.Integer),
+                       sa.column('email', sa.String),
+                       sa.column('email_hash', sa.String))
+    bind = op.get_bind()
+    rows = bind.execute(sa.select([comment.c.id, comment.c.email])).fetchall()
+    for comment_id, email in rows:
+        bind.execute(comment.update()
+                     .where(comment.c.id == comment_id)
+                     .values(email_hash=hashlib.md5(
+                         (email or '').encode('UTF-8')).hexdigest()))
+
+
+def downgrade():
+    with op.batch_alter_table('comment') as batch_op:
+        batch_op.drop_column('email_hash')
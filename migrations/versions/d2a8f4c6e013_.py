@@ -0,0 +1,25 @@
+"""Index the entries by creation time for the lists of authors.
+
+Revision ID: d2a8f4c6e013
+Revises: b7d3e1f0a962
+Create Date: 2026-10-18 22:48:02.915336
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2a8f4c6e013'
+down_revision = 'b7d3e1f0a962'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_entry_created', 'entry', ['created_timestamp', 'id'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_entry_created', table_name='entry')
@@ -0,0 +1,77 @@
+"""Index the hot filter columns and give entry_tags a primary key.
+
+Revision ID: e5a07f3b8c21
+Revises: c41d8e6f2a57
+Create Date: 2026-10-18 14:22:36.610352
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a07f3b8c21'
+down_revision = 'c41d8e6f2a57'
+branch_labels = None
+depends_on = None
+
+
+def _rebuild_entry_tags(primary_key):
+    """
+    SQLite cannot add a primary key to an existing table, copy the pairs
+    into a new table instead, dropping duplicate and incomplete rows.
+    """
+    if primary_key:
+        columns = [
+            sa.Column('tag_id', sa.Integer(), nullable=False),
+            sa.Column('entry_id', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('tag_id', 'entry_id'),
+        ]
+    else:
+        columns = [
+            sa.Column('tag_id', sa.Integer(), nullable=True),
+            sa.Column('entry_id', sa.Integer(), nullable=True),
+        ]
+    op.create_table(
+        'entry_tags_new',
+        *(columns + [sa.ForeignKeyConstraint(['tag_id'], ['tag.id'], ),
+                     sa.ForeignKeyConstraint(['entry_id'], ['entry.id'], )]))
+    op.execute('INSERT INTO entry_tags_new (tag_id, entry_id) '
+               'SELECT DISTINCT tag_id, entry_id FROM entry_tags '
+               'WHERE tag_id IS NOT NULL AND entry_id IS NOT NULL')
+    op.drop_table('entry_tags')
+    op.rename_table('entry_tags_new', 'entry_tags')
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        _rebuild_entry_tags(primary_key=True)
+    else:
+        op.alter_column('entry_tags', 'tag_id', nullable=False)
+        op.alter_column('entry_tags', 'entry_id', nullable=False)
+        op.create_primary_key('pk_entry_tags', 'entry_tags',
+                              ['tag_id', 'entry_id'])
+    op.create_index('ix_entry_tags_entry_id', 'entry_tags',
+                    ['entry_id', 'tag_id'], unique=False)
+    op.create_index('ix_entry_status_created', 'entry',
+                    ['status', 'created_timestamp', 'id'], unique=False)
+    op.create_index('ix_entry_author_status', 'entry',
+                    ['author_id', 'status'], unique=False)
+    op.create_index(op.f('ix_tag_name'), 'tag', ['name'], unique=False)
+    op.create_index('ix_comment_entry_status', 'comment',
+                    ['entry_id', 'status', 'id'], unique=False)
+    op.create_index('ix_comment_status', 'comment', ['status', 'id'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_comment_status', table_name='comment')
+    op.drop_index('ix_comment_entry_status', table_name='comment')
+    op.drop_index(op.f('ix_tag_name'), table_name='tag')
+    op.drop_index('ix_entry_author_status', table_name='entry')
+    op.drop_index('ix_entry_status_created', table_name='entry')
+    op.drop_index('ix_entry_tags_entry_id', table_name='entry_tags')
+    if op.get_bind().dialect.name == 'sqlite':
+        _rebuild_entry_tags(primary_key=False)
+    else:
+        op.drop_constraint('pk_entry_tags', 'entry_tags', type_='primary')
@@ -1,18 +1,18 @@
-import datetime, re, urllib, hashlib
+import datetime, urllib, hashlib
 
-from app import db, login_manager, bcrypt
-
-# Helper function to generate nice-looking URLs.
-def slugify(s):
-    # Turn a human readable string into a URL separated
-    # by hyphens.
-    return re.sub('[^\w]+', '-', s).lower()
+import passwords
+from app import db
+# Helper functions to generate nice-looking URLs.
+from slugs import slugify, source_changed
     
 # Specify a table to store the mapping of the pivot table exhibiting the
 # many to many relationship between the Entry and Tag models.
 entry_tags = db.Table('entry_tags',
-    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id')),
-    db.Column('entry_id', db.Integer, db.ForeignKey('entry.id'))                      
+    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id'), primary_key=True),
+    db.Column('entry_id', db.Integer, db.ForeignKey('entry.id'),
+              primary_key=True),
+    # The primary key covers lookups by tag, this index those by entry.
+    db.Index('ix_entry_tags_entry_id', 'entry_id', 'tag_id')
                       )
     
 class Entry(db.Model):
@@ -20,6 +20,16 @@ class Entry(db.Model):
     STATUS_DRAFT = 1
     STATUS_DELETED = 2
     
+    __table_args__ = (
+        # Entry lists filter on status and page newest first.
+        db.Index('ix_entry_status_created', 'status', 'created_timestamp',
+                 'id'),
+        # Authors see their own drafts next to the public entries.
+        db.Index('ix_entry_author_status', 'author_id', 'status'),
+        # Their lists mix several statuses, newest first.
+        db.Index('ix_entry_created', 'created_timestamp', 'id'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100))
     slug = db.Column(db.String(100), unique=True)
@@ -29,6 +39,14 @@ class Entry(db.Model):
     modified_timestamp = db.Column(db.DateTime, default=datetime.datetime.now,
                                    onupdate=datetime.datetime.now)
     author_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    # Number of public comments, kept up to date by the comments module.
+    comment_count = db.Column(db.Integer, default=0, server_default='0',
+                              nullable=False)
+    # Body rendered from Markdown to sanitized HTML, and its plain-text
+    # teaser, stored by the rendering module when the entry is saved.
+    body_html = db.Column(db.Text)
+    tease_text = db.Column(db.String(100))
+    render_version = db.Column(db.Integer)
                      
     # Query the Tag model via the entry_tags table.
     # Create a back reference that allows to go from the Tag model back to
@@ -46,8 +64,9 @@ class Entry(db.Model):
         self.generate_slug()
         
     def generate_slug(self):
-        self.slug = ''
-        if self.title:
+        # Left alone while the title is unchanged. The flush numbers the
+        # slug if another entry already has it, see slugs.py.
+        if source_changed(self, 'title'):
             self.slug = slugify(self.title)
             
     @property
@@ -62,7 +81,9 @@ class Entry(db.Model):
         """
         Return the first 100 characters in the body's text.
         """
-        return self.body[:100]
+        if self.tease_text is not None:
+            return self.tease_text
+        return (self.body or '')[:100]
             
     # Generate a helpful representation of instances of this Entry class.
     def __repr__(self):
@@ -70,16 +91,39 @@ class Entry(db.Model):
         
 class Tag(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(64))
+    name = db.Column(db.String(64), index=True, unique=True)
     slug = db.Column(db.String(64), unique=True)
     
     def __init__(self, *args, **kwargs):
         super(Tag, self).__init__(*args, **kwargs)
-        self.slug = slugify(self.name)
+        self.generate_slug()
         
+    def generate_slug(self):
+        if source_changed(self, 'name'):
+            self.slug = slugify(self.name)
+            
     def __repr__(self):
         return '<Tag: {}>'.format(self.name)
         
+class TagStats(db.Model):
+    """
+    Number of public entries and creation time of the newest one for each
+    tag, kept up to date by the tag_stats module.
+    """
+    __tablename__ = 'tag_stats'
+    __table_args__ = (
+        # The tag index lists the most used tags first.
+        db.Index('ix_tag_stats_entry_count', 'entry_count', 'tag_id'),
+    )
+    
+    tag_id = db.Column(db.Integer, db.ForeignKey('tag.id'), primary_key=True)
+    entry_count = db.Column(db.Integer, default=0, server_default='0',
+                            nullable=False)
+    last_used = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return '<TagStats: {} {}>'.format(self.tag_id, self.entry_count)
+        
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(64), unique=True)
@@ -96,7 +140,7 @@ class User(db.Model):
         self.generate_slug()
         
     def generate_slug(self):
-        if self.name:
+        if self.name and source_changed(self, 'name'):
             self.slug = slugify(self.name)
             
     # Flask-login interface.
@@ -120,15 +164,16 @@ class User(db.Model):
     def make_password(plaintext):
         """
         Accept a plaintext password and return the hashed version.
+        Hashing runs in the bcrypt process pool.
         """
-        return bcrypt.generate_password_hash(plaintext)
+        return passwords.hash_password(plaintext)
         
     def check_password(self, raw_password):
         """
         Accept a plaintext password and determine whether it matches
         the hashed version stored in the database.
         """
-        return bcrypt.check_password_hash(self.password_hash, raw_password)
+        return passwords.check_password(self.password_hash, raw_password)
         
     @classmethod
     def create(cls, email, password, **kwargs):
@@ -148,6 +193,12 @@ class User(db.Model):
         """
         user = User.query.filter(User.email == email).first()
         if user and user.check_password(password):
+            # The work factor changed since the password was set, upgrade
+            # the hash while the plaintext is at hand.
+            if passwords.needs_rehash(user.password_hash):
+                user.password_hash = User.make_password(password)
+                db.session.add(user)
+                db.session.commit()
             return user
         return False
         
@@ -163,31 +214,44 @@ class Comment(db.Model):
     STATUS_SPAM = 8
     STATUS_DELETED = 9
     
+    __table_args__ = (
+        # Comments of an entry are read by status, oldest first.
+        db.Index('ix_comment_entry_status', 'entry_id', 'status', 'id'),
+        # The comment API and moderation list every comment of a status.
+        db.Index('ix_comment_status', 'status', 'id'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64))
     email = db.Column(db.String(64))
     url = db.Column(db.String(100))
     ip_address = db.Column(db.String(64))
+    # MD5 of the email, computed once on insert for the gravatar URL.
+    email_hash = db.Column(db.String(32))
     body = db.Column(db.Text)
     status = db.Column(db.SmallInteger, default=STATUS_PUBLIC)
     created_timestamp = db.Column(db.DateTime, default=datetime.datetime.now)
+    # Set on every update, moderation included, for the validators of the
+    # comment lists.
+    modified_timestamp = db.Column(db.DateTime, default=datetime.datetime.now,
+                                   onupdate=datetime.datetime.now)
     entry_id = db.Column(db.Integer, db.ForeignKey('entry.id'))
     
+    @staticmethod
+    def hash_email(email):
+        return hashlib.md5((email or '').encode('UTF-8')).hexdigest()
+
+    @staticmethod
+    def gravatar_url(email_hash, size=75):
+        return 'http://www.gravatar.com/avatar.php?{}'.format(
+            urllib.parse.urlencode([
+                ('gravatar_id', email_hash),
+                ('size', str(size))]))
+
     # Display an avatar next to a user's comment.
     def gravatar(self, size=75):
-        return 'http://www.gravatar.com/avatar.php?{}'.format(
-            urllib.parse.urlencode({
-                'gravatar_id': hashlib.md5(self.email.encode('UTF-8')).hexdigest(),
-                'size': str(size)}))
+        return Comment.gravatar_url(
+            self.email_hash or Comment.hash_email(self.email), size)
     
     def __repr__(self):
         return '<Comment from {}>'.format(self.name)
-            
-# Tell Flask-login how to determine which user is logged in.
-@login_manager.user_loader
-def _user_loader(user_id):
-    """
-    Accept the id stored in the session and return a User
-    object from the database.
-    """
-    return User.query.get(int(user_id))
\ No newline at end of file
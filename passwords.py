@@ -0,0 +1,91 @@
+import hmac, threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+import bcrypt
+from werkzeug.exceptions import ServiceUnavailable
+
+from app import app
+from instrumentation import timed
+
+_pool = None
+_pool_lock = threading.Lock()
+# Bounds the number of hashing jobs queued or running at once.
+_slots = threading.BoundedSemaphore(app.config['PASSWORD_QUEUE_LIMIT'])
+
+def _to_bytes(value):
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    return value
+
+# The two functions below run in the worker processes.
+def _hash(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+def _check(password, password_hash):
+    return hmac.compare_digest(bcrypt.hashpw(password, password_hash),
+                               password_hash)
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=app.config['PASSWORD_POOL_WORKERS'])
+        return _pool
+
+def _run(fn, *args):
+    """
+    Run fn in the bcrypt process pool, keeping the request thread free of
+    CPU-bound work. Shed load with a 503 once the queue is full, or when
+    the job is not done within PASSWORD_POOL_TIMEOUT seconds.
+    """
+    with timed('bcrypt'):
+        if not app.config['PASSWORD_POOL_WORKERS']:
+            return fn(*args)
+        if not _slots.acquire(blocking=False):
+            raise ServiceUnavailable(
+                'Too many logins in progress, please try again shortly.')
+        try:
+            future = _get_pool().submit(fn, *args)
+        except Exception:
+            _slots.release()
+            raise
+        # The slot is held until the job is done, not until the request
+        # stops waiting for it, so that the queue stays bounded.
+        future.add_done_callback(lambda future: _slots.release())
+        try:
+            return future.result(timeout=app.config['PASSWORD_POOL_TIMEOUT'])
+        except TimeoutError:
+            raise ServiceUnavailable(
+                'Logins are taking too long, please try again shortly.')
+
+def hash_password(plaintext):
+    """
+    Hash the plaintext password with the configured bcrypt work factor.
+    """
+    hashed = _run(_hash, _to_bytes(plaintext),
+                  app.config['BCRYPT_LOG_ROUNDS'])
+    return hashed.decode('utf-8')
+
+def check_password(password_hash, plaintext):
+    """
+    Determine whether the plaintext password matches the bcrypt hash.
+    """
+    if not password_hash:
+        return False
+    try:
+        return _run(_check, _to_bytes(plaintext), _to_bytes(password_hash))
+    except ValueError:
+        # The stored value is not a bcrypt hash.
+        return False
+
+def needs_rehash(password_hash):
+    """
+    Determine whether the hash was made with another work factor than the
+    one currently configured. Hashes look like $2b$<rounds>$<salt+digest>.
+    """
+    try:
+        rounds = int(_to_bytes(password_hash).split(b'$')[2])
+    except (IndexError, ValueError):
+        return True
+    return rounds != app.config['BCRYPT_LOG_ROUNDS']
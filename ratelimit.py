@@ -0,0 +1,155 @@
+import sqlite3, threading, time
+from collections import OrderedDict
+
+from app import app
+
+# Seconds between two sweeps of the expired buckets.
+_PRUNE_INTERVAL = 60
+
+class MemoryBuckets(object):
+    """
+    Token buckets kept in process memory. Each key holds up to capacity
+    tokens and regains rate tokens per second, an action costs one token.
+    A throttled key is remembered for retention seconds, see
+    throttled_since. At most max_keys keys are kept, the least recently
+    used go first.
+    """
+    def __init__(self, rate, capacity, max_keys=10000, retention=0):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self.retention = retention
+        self._lock = threading.Lock()
+        # key -> [tokens, updated, last time the key was throttled], least
+        # recently used first.
+        self._buckets = OrderedDict()
+        self._pruned = time.time()
+
+    def _prune(self, now):
+        # Buckets which have refilled completely, and were not throttled
+        # within the retention time, carry no state.
+        full = (self.capacity / self.rate) if self.rate else float('inf')
+        for key, (tokens, updated, throttled) in list(self._buckets.items()):
+            if (now - updated >= full and
+                    (throttled is None or now - throttled >= self.retention)):
+                del self._buckets[key]
+        self._pruned = now
+
+    def consume(self, key):
+        """
+        Take a token for key, return the number of seconds to wait before
+        trying again when the bucket is empty, 0 otherwise.
+        """
+        now = time.time()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if (len(self._buckets) >= self.max_keys or
+                        now - self._pruned >= _PRUNE_INTERVAL):
+                    self._prune(now)
+                while len(self._buckets) >= self.max_keys:
+                    self._buckets.popitem(last=False)
+                bucket = self._buckets[key] = [self.capacity, now, None]
+            else:
+                self._buckets.move_to_end(key)
+            tokens = min(self.capacity,
+                         bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if tokens < 1:
+                bucket[0] = tokens
+                bucket[2] = now
+                return (1 - tokens) / self.rate
+            bucket[0] = tokens - 1
+            return 0
+
+    def throttled_since(self, key, since):
+        """
+        Determine whether the key was throttled after the given time.
+        """
+        with self._lock:
+            bucket = self._buckets.get(key)
+            return bool(bucket and bucket[2] and bucket[2] >= since)
+
+class SQLiteBuckets(object):
+    """
+    Token buckets stored in a local SQLite file, shared by every worker
+    process on the host. Same interface as MemoryBuckets.
+    """
+    def __init__(self, path, rate, capacity, max_keys=10000, retention=0):
+        self.path = path
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self.retention = retention
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS bucket ('
+                'key TEXT PRIMARY KEY, tokens REAL, updated REAL, '
+                'throttled REAL)')
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS bucket_updated '
+                'ON bucket (updated)')
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared between threads.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5,
+                                   isolation_level='IMMEDIATE')
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def consume(self, key):
+        now = time.time()
+        # The bucket is read and written under the write lock of an
+        # IMMEDIATE transaction, so concurrent workers cannot both take
+        # the last token.
+        with self._connection() as conn:
+            conn.execute(
+                'INSERT OR IGNORE INTO bucket (key, tokens, updated) '
+                'VALUES (?, ?, ?)', (key, self.capacity, now))
+            tokens, updated = conn.execute(
+                'SELECT tokens, updated FROM bucket WHERE key = ?',
+                (key,)).fetchone()
+            tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                conn.execute(
+                    'UPDATE bucket SET tokens = ?, updated = ?, '
+                    'throttled = ? WHERE key = ?', (tokens, now, now, key))
+                return (1 - tokens) / self.rate
+            conn.execute(
+                'UPDATE bucket SET tokens = ?, updated = ? WHERE key = ?',
+                (tokens - 1, now, key))
+            # Drop the buckets which have refilled completely and were not
+            # throttled within the retention time, then the least recently
+            # used beyond max_keys.
+            if self.rate:
+                conn.execute(
+                    'DELETE FROM bucket WHERE updated < ? AND '
+                    '(throttled IS NULL OR throttled < ?)',
+                    (now - self.capacity / self.rate, now - self.retention))
+            conn.execute(
+                'DELETE FROM bucket WHERE key IN (SELECT key FROM bucket '
+                'ORDER BY updated DESC LIMIT -1 OFFSET ?)', (self.max_keys,))
+            return 0
+
+    def throttled_since(self, key, since):
+        row = self._connection().execute(
+            'SELECT throttled FROM bucket WHERE key = ?', (key,)).fetchone()
+        return bool(row and row[0] and row[0] >= since)
+
+def make_buckets(config):
+    rate = config['COMMENT_RATE_LIMIT'] / config['COMMENT_RATE_PERIOD']
+    # Throttled addresses are looked up over the spam window, keep them
+    # that long.
+    options = {'max_keys': config['RATE_LIMIT_MAX_KEYS'],
+               'retention': config['COMMENT_SPAM_WINDOW']}
+    if config['RATE_LIMIT_BACKEND'] == 'sqlite':
+        return SQLiteBuckets(config['RATE_LIMIT_PATH'], rate,
+                             config['COMMENT_RATE_BURST'], **options)
+    return MemoryBuckets(rate, config['COMMENT_RATE_BURST'], **options)
+
+comment_buckets = make_buckets(app.config)
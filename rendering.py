@@ -0,0 +1,111 @@
+import html, re
+from concurrent.futures import ProcessPoolExecutor
+
+import bleach
+import markdown
+from sqlalchemy import bindparam, inspect
+
+from models import Entry
+
+# Bump whenever the output of render_body changes, stored entries rendered
+# by an older version are then rendered again.
+RENDERER_VERSION = 1
+
+TEASER_LENGTH = 100
+
+_MARKDOWN_EXTENSIONS = [
+    'markdown.extensions.fenced_code',
+    'markdown.extensions.codehilite',
+    'markdown.extensions.tables',
+]
+_MARKDOWN_CONFIG = {
+    # Highlight with Pygments, styled by static/css/pygments.css.
+    'markdown.extensions.codehilite': {
+        'css_class': 'highlight',
+        'guess_lang': False,
+    },
+}
+
+# Markup allowed to survive sanitization, anything else is stripped.
+_ALLOWED_TAGS = [
+    'a', 'abbr', 'b', 'blockquote', 'br', 'code', 'div', 'em', 'h1', 'h2',
+    'h3', 'h4', 'h5', 'h6', 'hr', 'i', 'img', 'li', 'ol', 'p', 'pre',
+    'span', 'strong', 'table', 'tbody', 'td', 'th', 'thead', 'tr', 'ul',
+]
+_ALLOWED_ATTRIBUTES = {
+    '*': ['class'],
+    'a': ['href', 'title'],
+    'img': ['src', 'alt', 'title'],
+}
+
+_WHITESPACE = re.compile(r'\s+')
+
+def render_body(body):
+    """
+    Convert a Markdown body into sanitized HTML and a plain-text teaser.
+    Returns an (html, teaser) pair.
+    """
+    body_html = bleach.clean(
+        markdown.markdown(body or '', extensions=_MARKDOWN_EXTENSIONS,
+                          extension_configs=_MARKDOWN_CONFIG),
+        tags=_ALLOWED_TAGS, attributes=_ALLOWED_ATTRIBUTES, strip=True)
+    text = html.unescape(bleach.clean(body_html, tags=[], strip=True))
+    teaser = _WHITESPACE.sub(' ', text).strip()[:TEASER_LENGTH]
+    return body_html, teaser
+
+def needs_render(entry):
+    """
+    Determine whether the stored rendering of the entry is out of date.
+    """
+    if entry.render_version != RENDERER_VERSION:
+        return True
+    return inspect(entry).attrs.body.history.has_changes()
+
+def render_entry(entry):
+    """
+    Store the rendered body and teaser on the entry, unless the body and the
+    renderer are unchanged since it was last rendered.
+    """
+    if needs_render(entry):
+        entry.body_html, entry.tease_text = render_body(entry.body)
+        entry.render_version = RENDERER_VERSION
+    return entry
+
+def rerender_entries(connection, all_entries=False, workers=None,
+                     batch_size=500, keep_timestamps=False):
+    """
+    Render again every entry rendered by an older renderer version, or all of
+    them, spreading the work over a process pool. Returns the number of
+    entries rendered. With keep_timestamps, the modified timestamp of the
+    entries is left alone, as when rendering freshly imported entries.
+    """
+    table = Entry.__table__
+    query = (table.select()
+             .with_only_columns([table.c.id, table.c.body])
+             .order_by(table.c.id)
+             .limit(batch_size))
+    if not all_entries:
+        query = query.where(
+            (table.c.render_version == None) |
+            (table.c.render_version != RENDERER_VERSION))
+    update = table.update().where(table.c.id == bindparam('entry_id'))
+    if keep_timestamps:
+        update = update.values(modified_timestamp=table.c.modified_timestamp)
+
+    count = last_id = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            # Walk the table by id, a batch at a time.
+            batch = connection.execute(
+                query.where(table.c.id > last_id)).fetchall()
+            if not batch:
+                break
+            rendered = pool.map(render_body, [row.body for row in batch],
+                                chunksize=32)
+            connection.execute(update, [
+                {'entry_id': row.id, 'body_html': body_html,
+                 'tease_text': teaser, 'render_version': RENDERER_VERSION}
+                for row, (body_html, teaser) in zip(batch, rendered)])
+            count += len(batch)
+            last_id = batch[-1].id
+    return count
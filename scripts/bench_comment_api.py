@@ -0,0 +1,57 @@
+import json, timeit
+
+from common import use_throwaway_database
+
+from app import app
+
+use_throwaway_database()
+
+from main import db, search
+from app import api as api_manager
+from instrumentation import count_queries
+from models import Comment, Entry
+
+ENTRIES = 50
+COMMENTS_PER_ENTRY = 200
+REQUESTS = 200
+
+# The Flask-Restless read API which /api/comment used to be, for comparison.
+api_manager.create_api(
+    Comment,
+    methods=['GET'],
+    url_prefix='/api/restless',
+    include_columns=['id', 'name', 'url', 'body', 'created_timestamp'],
+    include_methods=['gravatar'],
+    results_per_page=20)
+
+def seed():
+    db.create_all()
+    search.create_index(db.engine)
+    for i in range(ENTRIES):
+        entry = Entry(title='Entry {}'.format(i), body='Body')
+        db.session.add(entry)
+        for j in range(COMMENTS_PER_ENTRY):
+            db.session.add(Comment(
+                name='Reader {}'.format(j),
+                email='reader{}@example.com'.format(j),
+                url='http://example.com/', body='Comment body ' * 10,
+                entry=entry))
+    db.session.commit()
+
+def measure(client, label, url):
+    with count_queries() as counter:
+        seconds = timeit.timeit(lambda: client.get(url), number=REQUESTS)
+    data = json.loads(client.get(url).data.decode('utf-8'))
+    print('{:<10} {:>6.2f} queries/request {:>8.3f} ms/request '
+          '{:>3} objects, num_results {}'.format(
+              label, counter.count / REQUESTS,
+              seconds * 1000 / REQUESTS,
+              len(data['objects']), data['num_results']))
+
+if __name__ == '__main__':
+    seed()
+    client = app.test_client()
+    query = json.dumps({'filters': [
+        {'name': 'entry_id', 'op': 'eq', 'val': ENTRIES // 2}]})
+    measure(client, 'restless', '/api/restless/comment?q={}'.format(query))
+    measure(client, 'lean', '/api/comment?q={}'.format(query))
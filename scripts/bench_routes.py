@@ -0,0 +1,277 @@
+"""
+Latency benchmark for the public pages, the login, the comment API and the
+admin lists. Seeds a throwaway database with synthetic data, requests every
+route a number of times and prints, then saves as JSON, the p50/p95/p99
+latency, the requests per second and the SQL statements per request.
+
+    python scripts/bench_routes.py --entries 2000 --output before.json
+    python scripts/bench_routes.py --server --output server.json
+"""
+import datetime, http.cookiejar, itertools, json, re, sys, threading, time
+import urllib.error, urllib.parse, urllib.request
+
+from common import parse_args, percentile, use_throwaway_database
+
+from app import app
+
+def add_arguments(parser):
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--entries', type=int, default=500)
+    parser.add_argument('--tags', type=int, default=50,
+                        help='Number of distinct tags.')
+    parser.add_argument('--tags-per-entry', type=int, default=3)
+    parser.add_argument('--comments-per-entry', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=200,
+                        help='Requests per route.')
+    parser.add_argument('--database', default=None,
+                        help='SQLite file to seed, a temporary one by '
+                             'default. blog.db is never touched.')
+    parser.add_argument('--page-cache', action='store_true',
+                        help='Leave the page cache enabled.')
+    parser.add_argument('--server', action='store_true',
+                        help='Go through a real WSGI server on localhost '
+                             'instead of the Flask test client.')
+    parser.add_argument('--output', default=None,
+                        help='Write the results to this JSON file.')
+
+ARGS = parse_args(__doc__, add_arguments)
+
+DB_FILE = use_throwaway_database(path=ARGS.database)
+app.config['PAGE_CACHE_ENABLED'] = ARGS.page_cache
+app.config['PAGE_CACHE_BACKEND'] = 'memory'
+# Every comment comes from the same address, the limiter would answer most
+# of them with a 429.
+app.config['COMMENT_RATE_LIMIT_ENABLED'] = False
+
+from main import db, comments, rendering, search, tag_stats
+from bulk import Importer
+from instrumentation import count_queries
+from models import Comment
+from passwords import hash_password
+
+PASSWORD = 'secret'
+WORDS = ('python flask sqlite cache index query template render latency '
+         'request session cursor comment search feed admin').split()
+
+def seed():
+    """
+    Insert the synthetic data with the bulk importer, then build the
+    derived columns and the search index as import_data does.
+    """
+    db.create_all()
+    search.create_index(db.engine)
+    # Hashing is slow on purpose, every user shares a single hash.
+    password_hash = hash_password(PASSWORD)
+    words = itertools.cycle(WORDS)
+    start = datetime.datetime(2015, 1, 1)
+    timestamp = lambda minutes: (
+        start + datetime.timedelta(minutes=minutes)).isoformat()
+    with db.engine.connect() as connection:
+        importer = Importer(connection)
+        for i in range(1, ARGS.users + 1):
+            importer.add({
+                'type': 'user', 'id': i, 'email': 'user{}@example.com'.format(i),
+                'password_hash': password_hash, 'name': 'User {}'.format(i),
+                'slug': 'user-{}'.format(i), 'active': True, 'admin': i == 1,
+                'created_timestamp': timestamp(0)})
+        for i in range(ARGS.tags):
+            importer.add({'type': 'tag', 'name': 'tag{}'.format(i),
+                          'slug': 'tag{}'.format(i)})
+        comment_id = itertools.count(1)
+        for i in range(1, ARGS.entries + 1):
+            body = ' '.join(next(words) for _ in range(200))
+            importer.add({
+                'type': 'entry', 'id': i, 'title': 'Entry {}'.format(i),
+                'slug': 'entry-{}'.format(i), 'body': body, 'status': 0,
+                'author_id': i % ARGS.users + 1,
+                'created_timestamp': timestamp(i),
+                'modified_timestamp': timestamp(i)})
+            for j in range(min(ARGS.tags_per_entry, ARGS.tags)):
+                importer.add({'type': 'entry_tag', 'entry_id': i,
+                              'tag': 'tag{}'.format((i + j) % ARGS.tags)})
+            for j in range(ARGS.comments_per_entry):
+                importer.add({
+                    'type': 'comment', 'id': next(comment_id), 'entry_id': i,
+                    'name': 'Reader {}'.format(j),
+                    'email': 'reader{}@example.com'.format(j),
+                    'body': 'Comment body ' * 10,
+                    'status': Comment.STATUS_PUBLIC,
+                    'created_timestamp': timestamp(i + j)})
+        importer.close()
+    with db.engine.begin() as connection:
+        rendering.rerender_entries(connection, keep_timestamps=True)
+        comments.refresh_comment_counts(connection)
+        tag_stats.rebuild_tag_stats(connection)
+        search.rebuild_index(connection)
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+class ServerClient(object):
+    """
+    Minimal stand-in for the test client which talks HTTP to a server,
+    keeping cookies and not following redirects.
+    """
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+            _NoRedirect)
+
+    def open(self, url, data=None, content_type=None):
+        request = urllib.request.Request(self.base_url + url, data=data)
+        if content_type:
+            request.add_header('Content-Type', content_type)
+        try:
+            with self.opener.open(request) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as error:
+            return error.code
+
+    def get(self, url):
+        return self.open(url)
+
+    def post(self, url, data=None, content_type=None):
+        if content_type is None:
+            data = urllib.parse.urlencode(data)
+            content_type = 'application/x-www-form-urlencoded'
+        return self.open(url, data.encode('utf-8'), content_type)
+
+class TestClient(object):
+    def __init__(self):
+        self.client = app.test_client()
+
+    def get(self, url):
+        return self._read(self.client.get(url))
+
+    def post(self, url, data=None, content_type=None):
+        return self._read(self.client.post(url, data=data,
+                                           content_type=content_type))
+
+    def _read(self, response):
+        # Streamed pages are only rendered as their body is read.
+        response.get_data()
+        return response.status_code
+
+def start_server():
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, app, threaded=False,
+                         request_handler=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:{}'.format(server.server_port)
+
+def measure(label, request):
+    """
+    Call request() ARGS.requests times, request receives the iteration
+    number so that it can vary the URL.
+    """
+    latencies = []
+    statuses = {}
+    with count_queries() as counter:
+        started = time.perf_counter()
+        for i in range(ARGS.requests):
+            before = time.perf_counter()
+            status = request(i)
+            latencies.append((time.perf_counter() - before) * 1000)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    result = {
+        'requests': ARGS.requests,
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'requests_per_second': round(ARGS.requests / elapsed, 1),
+        'queries_per_request': round(counter.count / ARGS.requests, 2),
+        'statuses': statuses,
+    }
+    print('{:<14} p50 {p50_ms:>8.2f} ms  p95 {p95_ms:>8.2f} ms  '
+          'p99 {p99_ms:>8.2f} ms  {requests_per_second:>8.1f} req/s  '
+          '{queries_per_request:>6.2f} queries/request  {statuses}'.format(
+              label, **result))
+    return result
+
+def second_page_url():
+    """
+    Return the URL of the second page of entries, which cursor pagination
+    addresses with the token of the next link rather than a page number.
+    """
+    body = app.test_client().get('/entries/').get_data(as_text=True)
+    match = re.search(r'href="\./\?cursor=([^"]+)">&raquo;', body)
+    if match is None:
+        sys.exit('The first page of entries has no next link, '
+                 'seed more entries.')
+    return '/entries/?cursor={}'.format(match.group(1))
+
+def run(make_client):
+    anonymous = make_client()
+    admin = make_client()
+    admin.post('/login/', {'email': 'user1@example.com',
+                           'password': PASSWORD})
+    entry_ids = [(i % ARGS.entries) + 1 for i in range(ARGS.requests)]
+    tag_count = max(ARGS.tags, 1)
+    page_url = second_page_url()
+    api_query = lambda i: urllib.parse.quote(json.dumps({'filters': [
+        {'name': 'entry_id', 'op': 'eq', 'val': entry_ids[i]}]}))
+
+    def login(i):
+        # A fresh client each time, so every request really logs in.
+        return make_client().post('/login/', {
+            'email': 'user{}@example.com'.format(i % ARGS.users + 1),
+            'password': PASSWORD})
+
+    def post_comment(i):
+        return anonymous.post('/api/comment', json.dumps({
+            'name': 'Bench', 'email': 'bench@example.com',
+            'body': 'A benchmark comment.', 'entry_id': entry_ids[i]}),
+            'application/json')
+
+    routes = [
+        ('index', lambda i: anonymous.get('/entries/')),
+        ('index_page', lambda i: anonymous.get(page_url)),
+        ('detail', lambda i: anonymous.get(
+            '/entries/entry-{}/'.format(entry_ids[i]))),
+        ('tag_index', lambda i: anonymous.get('/entries/tags/')),
+        ('tag_detail', lambda i: anonymous.get(
+            '/entries/tags/tag{}/'.format(i % tag_count))),
+        ('search', lambda i: anonymous.get(
+            '/entries/?q={}'.format(WORDS[i % len(WORDS)]))),
+        ('login', login),
+        ('api_get', lambda i: anonymous.get(
+            '/api/comment?q={}'.format(api_query(i)))),
+        ('api_post', post_comment),
+        ('admin_entries', lambda i: admin.get('/admin/entry/')),
+        ('admin_tags', lambda i: admin.get('/admin/tag/')),
+        ('admin_users', lambda i: admin.get('/admin/user/')),
+    ]
+    return dict((label, measure(label, request))
+                for label, request in routes)
+
+if __name__ == '__main__':
+    seed()
+    server = None
+    if ARGS.server:
+        server, base_url = start_server()
+        make_client = lambda: ServerClient(base_url)
+    else:
+        make_client = TestClient
+    try:
+        results = run(make_client)
+    finally:
+        if server is not None:
+            server.shutdown()
+    if ARGS.output:
+        settings = dict(vars(ARGS), database=DB_FILE)
+        with open(ARGS.output, 'w') as fileobj:
+            json.dump({'settings': settings, 'routes': results}, fileobj,
+                      indent=2, sort_keys=True)
+        print('Results written to {}.'.format(ARGS.output))
@@ -0,0 +1,87 @@
+"""
+Microbenchmark for slug generation. Compares models.slugify as it was,
+re.sub with an uncompiled pattern, against slugs.slugify, then the
+numbered-suffix retry loop against slugs.unique_slug on a title which
+already has many duplicates.
+
+    python scripts/bench_slugs.py --number 100000 --duplicates 200
+"""
+import re, timeit
+
+from common import parse_args, use_throwaway_database
+
+def add_arguments(parser):
+    parser.add_argument('--number', type=int, default=100000,
+                        help='Calls to time for each slugify variant.')
+    parser.add_argument('--duplicates', type=int, default=200,
+                        help='Entries already sharing the benchmarked title.')
+    parser.add_argument('--repeat', type=int, default=200,
+                        help='Calls to time for each collision strategy.')
+
+ARGS = parse_args(__doc__, add_arguments)
+
+use_throwaway_database()
+
+from main import db, search
+from bulk import Importer
+from instrumentation import count_queries
+from models import Entry
+from slugs import slugify, unique_slug
+
+TITLES = {
+    'ascii': 'Measuring the latency of a Flask blog, part 12',
+    'accented': 'Crème brûlée à la façon de Straße: œuvres complètes',
+}
+
+def old_slugify(s):
+    return re.sub('[^\w]+', '-', s).lower()
+
+def bench_slugify():
+    for label, title in sorted(TITLES.items()):
+        for name, function in (('re.sub', old_slugify),
+                               ('slugify', slugify)):
+            seconds = timeit.timeit(lambda: function(title),
+                                    number=ARGS.number)
+            print('{:<10} {:<8} {:>8.3f} us/call  {!r}'.format(
+                label, name, seconds * 1e6 / ARGS.number, function(title)))
+
+def retry_slug(connection, column, slug):
+    # What a unique slug costs without the range query: one lookup per
+    # candidate until a free one is found.
+    candidate, number = slug, 1
+    while connection.execute(db.select([column]).where(
+            column == candidate)).first() is not None:
+        number += 1
+        candidate = '{}-{}'.format(slug, number)
+    return candidate
+
+def bench_unique_slug():
+    db.create_all()
+    search.create_index(db.engine)
+    base = slugify(TITLES['ascii'])
+    with db.engine.connect() as connection:
+        importer = Importer(connection)
+        for i in range(ARGS.duplicates):
+            importer.add({
+                'type': 'entry', 'id': i + 1, 'title': TITLES['ascii'],
+                'slug': base if i == 0 else '{}-{}'.format(base, i + 1),
+                'body': 'Body', 'status': 0})
+        importer.close()
+    column = Entry.__table__.c.slug
+    with db.engine.connect() as connection:
+        for name, function in (('retry loop', retry_slug),
+                               ('unique_slug', unique_slug)):
+            with count_queries() as counter:
+                seconds = timeit.timeit(
+                    lambda: function(connection, column, base),
+                    number=ARGS.repeat)
+            print('{:<12} {:>8.3f} ms/call {:>8.1f} queries/call  {}'.format(
+                name, seconds * 1000 / ARGS.repeat,
+                counter.count / ARGS.repeat,
+                function(connection, column, base)))
+
+if __name__ == '__main__':
+    bench_slugify()
+    print('')
+    print('{} entries titled {!r}:'.format(ARGS.duplicates, TITLES['ascii']))
+    bench_unique_slug()
@@ -0,0 +1,38 @@
+import timeit
+
+from common import use_throwaway_database
+
+from app import app
+
+use_throwaway_database()
+app.config['PAGE_CACHE_ENABLED'] = False
+# Keep the login itself cheap, only the per-request cost is measured.
+app.config['BCRYPT_LOG_ROUNDS'] = 4
+app.config['PASSWORD_POOL_WORKERS'] = 0
+
+from main import db
+from instrumentation import count_queries
+from models import User
+
+REQUESTS = 500
+
+def measure(client, cached):
+    app.config['USER_CACHE_ENABLED'] = cached
+    client.get('/')  # Warm the cache.
+    with count_queries() as counter:
+        seconds = timeit.timeit(lambda: client.get('/'), number=REQUESTS)
+    print('{:<10} {:>6.2f} queries/request {:>8.3f} ms/request'.format(
+        'cached' if cached else 'uncached',
+        counter.count / REQUESTS,
+        seconds * 1000 / REQUESTS))
+
+if __name__ == '__main__':
+    db.create_all()
+    db.session.add(User.create('bench@example.com', 'secret', name='Bench'))
+    db.session.commit()
+
+    client = app.test_client()
+    client.post('/login/', data={'email': 'bench@example.com',
+                                 'password': 'secret'})
+    measure(client, cached=False)
+    measure(client, cached=True)
@@ -0,0 +1,33 @@
+"""
+Helpers shared by the scripts in this directory, which are run from the
+root of the repository, e.g. python scripts/bench_routes.py.
+"""
+import argparse, os, sys, tempfile
+sys.path.append(os.getcwd())
+
+def use_throwaway_database(name='bench.db', path=None):
+    """
+    Point the app at a new SQLite file, or at path, rather than blog.db and
+    return its path. This has to be called before main is imported, the
+    first session binds to the engine.
+    """
+    from app import app
+    path = path or os.path.join(tempfile.mkdtemp(), name)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///{}'.format(path)
+    return path
+
+def parse_args(doc, add_arguments):
+    """
+    Parse the command line of a script described by the first line of its
+    docstring, add_arguments(parser) declares its options.
+    """
+    parser = argparse.ArgumentParser(description=doc.strip().split('\n')[0])
+    add_arguments(parser)
+    return parser.parse_args()
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile.
+    if not sorted_values:
+        return 0
+    index = max(0, int(round(fraction * len(sorted_values))) - 1)
+    return sorted_values[index]
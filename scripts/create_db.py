@@ -1,7 +1,8 @@
 import os, sys
 sys.path.append(os.getcwd())
 
-from main import db
+from main import db, search
 
 if __name__ == '__main__':
-    db.create_all()
\ No newline at end of file
+    db.create_all()
+    search.create_index(db.engine)
\ No newline at end of file
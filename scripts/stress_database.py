@@ -0,0 +1,176 @@
+"""
+Concurrency stress test for the database engine profile. Readers load the
+entry list and entry pages while writers post comments and authors save
+entries, all at the same time, first with the former engine defaults (a
+rollback journal and a new connection per checkout), then with the
+SQLITE_PRAGMAS and pool settings of the Configuration. Prints the
+throughput, the latencies and the number of "database is locked" errors
+of each.
+
+    python scripts/stress_database.py --readers 8 --writers 4 --duration 10
+"""
+import json, os, subprocess, sys, threading, time
+
+from common import parse_args, percentile, use_throwaway_database
+
+PROFILES = ('baseline', 'tuned')
+
+def add_arguments(parser):
+    parser.add_argument('--readers', type=int, default=8,
+                        help='Threads loading pages.')
+    parser.add_argument('--writers', type=int, default=4,
+                        help='Threads posting comments and saving entries.')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='Seconds each profile runs for.')
+    parser.add_argument('--entries', type=int, default=200)
+    parser.add_argument('--profile', choices=PROFILES, default=None,
+                        help='Run a single profile and print its results '
+                             'as JSON, both are compared by default.')
+
+ARGS = parse_args(__doc__, add_arguments)
+
+def run_profile(profile):
+    """
+    Seed a throwaway database and hammer it for ARGS.duration seconds.
+    Each profile runs in its own process, the engine is created once per
+    process.
+    """
+    from app import app
+    use_throwaway_database('stress.db')
+    app.config['PAGE_CACHE_ENABLED'] = False
+    app.config['COMMENT_RATE_LIMIT_ENABLED'] = False
+    if profile == 'baseline':
+        app.config['SQLITE_PRAGMAS'] = ()
+        for key in ('SQLALCHEMY_POOL_SIZE', 'SQLALCHEMY_MAX_OVERFLOW',
+                    'SQLALCHEMY_POOL_TIMEOUT', 'SQLALCHEMY_POOL_RECYCLE'):
+            app.config[key] = None
+
+    from main import db, search
+    from models import Entry, User
+
+    with app.app_context():
+        db.create_all()
+        search.create_index(db.engine)
+        author = User(email='author@example.com', name='Author')
+        db.session.add(author)
+        for i in range(ARGS.entries):
+            db.session.add(Entry(
+                title='Entry {}'.format(i), body='Entry body ' * 50,
+                status=Entry.STATUS_PUBLIC, author=author))
+        db.session.commit()
+        slugs = [slug for slug, in db.session.query(Entry.slug)]
+        entry_ids = [entry_id for entry_id, in db.session.query(Entry.id)]
+        journal_mode = db.session.execute('PRAGMA journal_mode').scalar()
+
+    results = dict((kind, {'latencies': [], 'errors': 0, 'locked': 0})
+                   for kind in ('read', 'comment', 'save'))
+    lock = threading.Lock()
+    deadline = time.perf_counter() + ARGS.duration
+
+    def record(kind, started, error=None):
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            result = results[kind]
+            if error is None:
+                result['latencies'].append(elapsed)
+            else:
+                result['errors'] += 1
+                if 'database is locked' in str(error):
+                    result['locked'] += 1
+
+    def read(client, i):
+        if i % 2:
+            url = '/entries/'
+        else:
+            url = '/entries/{}/'.format(slugs[i % len(slugs)])
+        response = client.get(url)
+        # Streamed pages are only rendered as their body is read.
+        response.get_data()
+        if response.status_code != 200:
+            raise RuntimeError('GET {} {}'.format(url, response.status_code))
+
+    def post_comment(client, i):
+        response = client.post('/api/comment', data=json.dumps({
+            'name': 'Stress', 'email': 'stress@example.com',
+            'body': 'A stress test comment.',
+            'entry_id': entry_ids[i % len(entry_ids)]}),
+            content_type='application/json')
+        if response.status_code != 201:
+            raise RuntimeError('POST {}'.format(response.status_code))
+
+    def save_entry(client, i):
+        with app.app_context():
+            entry = Entry.query.get(entry_ids[i % len(entry_ids)])
+            entry.body = 'Edited body {} '.format(i) * 50
+            db.session.commit()
+
+    def worker(actions, offset):
+        client = app.test_client()
+        i = offset
+        while time.perf_counter() < deadline:
+            kind, action = actions[i % len(actions)]
+            started = time.perf_counter()
+            try:
+                action(client, i)
+            except Exception as error:
+                record(kind, started, error)
+            else:
+                record(kind, started)
+            i += 1
+
+    threads = [threading.Thread(target=worker,
+                                args=([('read', read)], n))
+               for n in range(ARGS.readers)]
+    threads += [threading.Thread(target=worker, args=(
+                    [('comment', post_comment), ('save', save_entry)], n))
+                for n in range(ARGS.writers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    summary = {'journal_mode': journal_mode}
+    for kind, result in results.items():
+        latencies = sorted(result['latencies'])
+        summary[kind] = {
+            'completed': len(latencies),
+            'per_second': round(len(latencies) / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 0.50), 2),
+            'p95_ms': round(percentile(latencies, 0.95), 2),
+            'max_ms': round(latencies[-1] if latencies else 0, 2),
+            'errors': result['errors'],
+            'locked': result['locked'],
+        }
+    return summary
+
+def compare():
+    summaries = {}
+    for profile in PROFILES:
+        arguments = [sys.executable, os.path.abspath(__file__),
+                     '--profile', profile,
+                     '--readers', str(ARGS.readers),
+                     '--writers', str(ARGS.writers),
+                     '--duration', str(ARGS.duration),
+                     '--entries', str(ARGS.entries)]
+        output = subprocess.check_output(arguments)
+        # The results are the last line, the app may log before.
+        summaries[profile] = json.loads(
+            output.decode('utf-8').strip().split('\n')[-1])
+    print('{} readers, {} writers, {} seconds per profile.'.format(
+        ARGS.readers, ARGS.writers, ARGS.duration))
+    for profile in PROFILES:
+        summary = summaries[profile]
+        print('\n{} (journal_mode={})'.format(profile, summary['journal_mode']))
+        for kind in ('read', 'comment', 'save'):
+            print('  {:<8} {per_second:>8.1f}/s  p50 {p50_ms:>8.2f} ms  '
+                  'p95 {p95_ms:>8.2f} ms  max {max_ms:>9.2f} ms  '
+                  '{errors} errors, {locked} locked'.format(
+                      kind, **summary[kind]))
+
+if __name__ == '__main__':
+    if ARGS.profile:
+        print(json.dumps(run_profile(ARGS.profile)))
+    else:
+        compare()
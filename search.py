@@ -0,0 +1,118 @@
+from sqlalchemy import event, inspect, text
+from sqlalchemy.sql import literal_column
+
+from app import db
+from models import Entry
+
+# Name of the SQLite FTS5 virtual table mirroring Entry titles and bodies.
+# The rowid of every row in the index is the id of the Entry it mirrors.
+SEARCH_TABLE = 'entry_search'
+
+# The index is only populated for entries which can still be displayed.
+# Soft-deleted entries are dropped from it.
+_INDEXED_STATUSES = (Entry.STATUS_PUBLIC, Entry.STATUS_DRAFT)
+
+# Columns are kept in a separate MetaData so that db.create_all() does not
+# try to create the virtual table as an ordinary table.
+entry_search = db.Table(
+    SEARCH_TABLE, db.MetaData(),
+    db.Column('rowid', db.Integer, primary_key=True),
+    db.Column('title', db.Text),
+    db.Column('body', db.Text))
+
+def is_supported(bind):
+    """
+    Full-text search relies on the SQLite FTS5 extension.
+    """
+    return bind.dialect.name == 'sqlite'
+
+def create_index(bind):
+    """
+    Create the FTS5 virtual table if it does not exist yet. Nothing is
+    created on databases without FTS5.
+    """
+    if not is_supported(bind):
+        return
+    bind.execute(text(
+        'CREATE VIRTUAL TABLE IF NOT EXISTS {} '
+        'USING fts5(title, body)'.format(SEARCH_TABLE)))
+
+def rebuild_index(bind):
+    """
+    Drop the search index and repopulate it from the entry table.
+    Return the number of indexed entries, or None on databases without
+    FTS5, which have no index to rebuild.
+    """
+    if not is_supported(bind):
+        return None
+    bind.execute(text('DROP TABLE IF EXISTS {}'.format(SEARCH_TABLE)))
+    create_index(bind)
+    bind.execute(text(
+        'INSERT INTO {} (rowid, title, body) '
+        'SELECT id, title, body FROM entry '
+        'WHERE status IN (:public, :draft)'.format(SEARCH_TABLE)),
+        public=Entry.STATUS_PUBLIC, draft=Entry.STATUS_DRAFT)
+    # Merge the b-tree segments created by the bulk insert.
+    bind.execute(text(
+        "INSERT INTO {0} ({0}) VALUES ('optimize')".format(SEARCH_TABLE)))
+    return bind.execute(text(
+        'SELECT count(*) FROM {}'.format(SEARCH_TABLE))).scalar()
+
+def to_match_expression(phrase):
+    """
+    Turn a raw search phrase into an FTS5 MATCH expression.
+    Every word is quoted so that user input cannot inject FTS5 operators.
+    """
+    terms = ['"{}"'.format(word.replace('"', '""'))
+             for word in phrase.split()]
+    return ' '.join(terms)
+
+def search(query, phrase):
+    """
+    Restrict an Entry query to the entries matching the search phrase,
+    ordered by relevance (BM25).
+    """
+    expression = to_match_expression(phrase)
+    if not expression:
+        return query
+    if not is_supported(db.engine):
+        # Fall back to a LIKE scan on databases without FTS5.
+        return query.filter(
+            (Entry.title.contains(phrase))|
+            (Entry.body.contains(phrase)))
+    return (query
+            .join(entry_search, entry_search.c.rowid == Entry.id)
+            .filter(literal_column(SEARCH_TABLE).op('MATCH')(expression))
+            # Discard the caller's ordering, lower BM25 scores rank higher.
+            .order_by(None)
+            .order_by(text('bm25({})'.format(SEARCH_TABLE))))
+
+def _delete_from_index(connection, entry_id):
+    connection.execute(
+        entry_search.delete().where(entry_search.c.rowid == entry_id))
+
+def _write_to_index(connection, entry):
+    _delete_from_index(connection, entry.id)
+    if entry.status in _INDEXED_STATUSES:
+        connection.execute(entry_search.insert().values(
+            rowid=entry.id, title=entry.title, body=entry.body))
+
+# Keep the index in sync inside the same transaction as the Entry flush.
+@event.listens_for(Entry, 'after_insert')
+def _index_new_entry(mapper, connection, entry):
+    if is_supported(connection):
+        _write_to_index(connection, entry)
+
+@event.listens_for(Entry, 'after_update')
+def _reindex_entry(mapper, connection, entry):
+    state = inspect(entry)
+    # Skip updates which do not touch any of the indexed fields.
+    changed = any(state.attrs[name].history.has_changes()
+                  for name in ('title', 'body', 'status'))
+    if changed and is_supported(connection):
+        _write_to_index(connection, entry)
+
+@event.listens_for(Entry, 'after_delete')
+def _unindex_entry(mapper, connection, entry):
+    if is_supported(connection):
+        _delete_from_index(connection, entry.id)
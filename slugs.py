@@ -0,0 +1,94 @@
+import re, unicodedata
+
+from sqlalchemy import and_, event, inspect, or_, select
+from sqlalchemy.orm import Session
+
+# Everything but ASCII letters, digits and underscores separates words.
+_SEPARATORS = re.compile(r'[^\w]+', re.ASCII)
+# Used instead when transliteration leaves nothing, e.g. for CJK titles.
+_UNICODE_SEPARATORS = re.compile(r'[^\w]+')
+
+# Letters which do not decompose into an ASCII letter and an accent.
+_TRANSLITERATIONS = str.maketrans({
+    'ß': 'ss', 'æ': 'ae', 'Æ': 'AE', 'œ': 'oe', 'Œ': 'OE', 'ø': 'o',
+    'Ø': 'O', 'đ': 'd', 'Đ': 'D', 'ł': 'l', 'Ł': 'L', 'þ': 'th',
+    'Þ': 'TH', 'ð': 'd', 'Ð': 'D', 'ı': 'i',
+})
+
+def transliterate(text):
+    """
+    Replace accented and other Latin letters by their closest ASCII
+    spelling, dropping the characters which have none.
+    """
+    text = unicodedata.normalize('NFKD', text.translate(_TRANSLITERATIONS))
+    return text.encode('ascii', 'ignore').decode('ascii')
+
+def slugify(text):
+    """
+    Turn a human readable string into a lowercase URL component separated
+    by hyphens.
+    """
+    if not text:
+        return ''
+    try:
+        text.encode('ascii')
+    except UnicodeEncodeError:
+        ascii_text = transliterate(text)
+        if not _SEPARATORS.sub('', ascii_text):
+            return _UNICODE_SEPARATORS.sub('-', text).strip('-').lower()
+        text = ascii_text
+    return _SEPARATORS.sub('-', text).strip('-').lower()
+
+def source_changed(obj, source):
+    """
+    Determine whether the slug of obj has to be derived again from its
+    source attribute: it has no slug yet or the source was modified.
+    """
+    if not obj.slug:
+        return True
+    return inspect(obj).attrs[source].history.has_changes()
+
+def unique_slug(connection, column, slug, exclude_id=None, reserved=()):
+    """
+    Return slug when it is free in column, otherwise slug followed by the
+    lowest free number from 2 on. The slugs taken are read with a single
+    range query over the unique index of column. Pass exclude_id, the id of
+    the row the slug is for, to leave its current slug out, and reserved,
+    the slugs already given to rows which are not written yet.
+    """
+    max_length = column.type.length
+    if max_length:
+        slug = slug[:max_length].rstrip('-')
+    # Every string starting with "slug-" sorts between "slug-" and "slug.".
+    query = select([column]).where(or_(
+        column == slug, and_(column > slug + '-', column < slug + '.')))
+    if exclude_id is not None:
+        query = query.where(column.table.c.id != exclude_id)
+    taken = set(row[0] for row in connection.execute(query))
+    taken.update(reserved)
+    candidate = slug
+    number = 1
+    while candidate in taken:
+        number += 1
+        suffix = '-{}'.format(number)
+        stem = slug[:max_length - len(suffix)] if max_length else slug
+        candidate = stem + suffix
+    return candidate
+
+# Slugs are made unique at flush time, when the connection is at hand, so
+# that a duplicate title gets a numbered slug instead of an IntegrityError.
+@event.listens_for(Session, 'before_flush')
+def _deduplicate_slugs(session, flush_context, instances):
+    assigned = {}
+    for obj in list(session.new) + list(session.dirty):
+        table = getattr(obj, '__table__', None)
+        column = table.c.get('slug') if table is not None else None
+        if column is None or not column.unique or not obj.slug:
+            continue
+        state = inspect(obj)
+        if not state.attrs.slug.history.has_changes():
+            continue
+        reserved = assigned.setdefault(table.name, set())
+        obj.slug = unique_slug(session.connection(), column, obj.slug,
+                               exclude_id=obj.id, reserved=reserved)
+        reserved.add(obj.slug)
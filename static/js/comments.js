@@ -31,18 +31,39 @@ var commentMarkup = renderComment(comment);
 $('h4#comment-form').before($(commentMarkup));
 });
 }
-function load(entryId) {
+function load(entryId, cursor, callback) {
 var filters = [{
 'name': 'entry_id',
 'op': 'eq',
 'val': entryId}];
 var serializedQuery = JSON.stringify({'filters': filters});
-$.get('/api/comment', {'q': serializedQuery}, function(data) {
+var params = {'q': serializedQuery};
+if (cursor) {
+params['cursor'] = cursor;
+}
+$.get('/api/comment', params, function(data) {
 if (data['num_results'] === 0) {
 displayNoComments();
 } else {
 displayComments(data['objects']);
 }
+if (callback) {
+callback(data);
+}
+});
+}
+/* Fetch the next page of comments each time "more comments" is clicked.
+The cursor is the id of the last comment displayed. */
+function bindMoreHandler(entryId, cursor) {
+$('a#more-comments').on('click', function() {
+var link = $(this);
+load(entryId, cursor, function(data) {
+cursor = data['next_cursor'];
+if (!cursor) {
+link.remove();
+}
+});
+return false;
 });
 }
 
@@ -90,8 +111,12 @@ alertDiv = makeAlert('success', 'Success', 'your comment was posted.');
 form.before(alertDiv);
 form[0].reset();
 });
-request.fail(function() {
-alertDiv = makeAlert('danger', 'Error', 'your comment was not posted.');
+request.fail(function(xhr) {
+var message = 'your comment was not posted.';
+if (xhr.status === 429) {
+message = 'you are posting too fast, please try again later.';
+}
+alertDiv = makeAlert('danger', 'Error', message);
 form.before(alertDiv);
 });
 return false;
@@ -99,4 +124,5 @@ return false;
 }
 exports.load = load;
 exports.bindHandler = bindHandler;
+exports.bindMoreHandler = bindMoreHandler;
 })(Comments, jQuery);
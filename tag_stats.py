@@ -0,0 +1,163 @@
+import collections, math
+
+from sqlalchemy import bindparam, event, inspect, or_, select
+from sqlalchemy.orm import Session
+
+from app import db
+from models import Entry, Tag, TagStats, entry_tags
+
+_entry_table = Entry.__table__
+_tag_table = Tag.__table__
+_stats_table = TagStats.__table__
+
+# Font sizes of the tag cloud, see includes/tag_cloud.html.
+CLOUD_STEPS = 5
+
+# A tag of the cloud, weight ranges from 1 for the least used tags to
+# CLOUD_STEPS for the most used.
+CloudTag = collections.namedtuple('CloudTag', 'tag entry_count weight')
+
+def _public_usage(tag_ids=None):
+    # Every tag, with its number of public entries and the newest of them.
+    public_entries = ((_entry_table.c.id == entry_tags.c.entry_id) &
+                      (_entry_table.c.status == Entry.STATUS_PUBLIC))
+    query = (select([_tag_table.c.id,
+                     db.func.count(_entry_table.c.id),
+                     db.func.max(_entry_table.c.created_timestamp)])
+             .select_from(_tag_table
+                          .outerjoin(entry_tags,
+                                     entry_tags.c.tag_id == _tag_table.c.id)
+                          .outerjoin(_entry_table, public_entries))
+             .group_by(_tag_table.c.id))
+    if tag_ids is not None:
+        query = query.where(_tag_table.c.id.in_(tag_ids))
+    return query
+
+def rebuild_tag_stats(connection, tag_ids=None):
+    """
+    Recompute the statistics of the given tags, or of every tag, from the
+    entries. Used after bulk changes which bypass the session events below.
+    """
+    delete = _stats_table.delete()
+    if tag_ids is not None:
+        tag_ids = list(tag_ids)
+        if not tag_ids:
+            return
+        delete = delete.where(_stats_table.c.tag_id.in_(tag_ids))
+    connection.execute(delete)
+    connection.execute(_stats_table.insert().from_select(
+        ['tag_id', 'entry_count', 'last_used'], _public_usage(tag_ids)))
+
+def _weight(count, low, high, steps):
+    # Logarithmic, so that a few very common tags do not flatten the rest.
+    if high == low:
+        return 1
+    position = math.log(count + 1) - math.log(low + 1)
+    return 1 + int(round(
+        (steps - 1) * position / (math.log(high + 1) - math.log(low + 1))))
+
+def tag_cloud(limit, steps=CLOUD_STEPS):
+    """
+    Return the limit most used tags as CloudTags, most used first, with a
+    single query over the tag_stats index.
+    """
+    rows = (db.session.query(Tag, TagStats.entry_count)
+            .join(TagStats, TagStats.tag_id == Tag.id)
+            .order_by(TagStats.entry_count.desc(), TagStats.tag_id.desc())
+            .limit(limit)
+            .all())
+    if not rows:
+        return []
+    counts = [count for tag, count in rows]
+    low, high = min(counts), max(counts)
+    return [CloudTag(tag, count, _weight(count, low, high, steps))
+            for tag, count in rows]
+
+def _old_value(state, name):
+    history = state.attrs[name].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(state.obj(), name)
+
+def _usage_changes(session):
+    """
+    Compare the tags and status of the flushed entries with those they
+    had before. Return the number of public entries each tag gained along
+    with the newest of their creation times, and the ids of the tags which
+    lost one.
+    """
+    gained = {}
+    lost = set()
+    changed = list(session.new) + list(session.dirty) + list(session.deleted)
+    for entry in changed:
+        if not isinstance(entry, Entry):
+            continue
+        state = inspect(entry)
+        tags = state.attrs.tags.load_history()
+        unchanged = set(tag.id for tag in tags.unchanged)
+        old_tags = unchanged | set(tag.id for tag in tags.deleted)
+        new_tags = unchanged | set(tag.id for tag in tags.added)
+        old_public = (entry not in session.new and
+                      _old_value(state, 'status') == Entry.STATUS_PUBLIC)
+        new_public = (entry not in session.deleted and
+                      entry.status == Entry.STATUS_PUBLIC)
+        if not old_public:
+            old_tags = set()
+        if not new_public:
+            new_tags = set()
+        lost.update(old_tags - new_tags)
+        if state.attrs.created_timestamp.history.has_changes():
+            # The newest entry of the tags may have changed.
+            lost.update(old_tags & new_tags)
+        for tag_id in new_tags - old_tags:
+            count, newest = gained.get(tag_id, (0, None))
+            created = entry.created_timestamp
+            if newest is not None and created is not None:
+                created = max(created, newest)
+            gained[tag_id] = (count + 1, created or newest)
+    return gained, lost
+
+# Applies one tag's gain: count up and keep the newest creation time.
+_last_used = _stats_table.c.last_used
+_gained_last_used = bindparam('gained_last_used', type_=db.DateTime)
+_gain = (_stats_table.update()
+         .where(_stats_table.c.tag_id == bindparam('gained_tag_id'))
+         .values(entry_count=_stats_table.c.entry_count +
+                 bindparam('gained_count'),
+                 last_used=db.case(
+                     [(or_(_last_used.is_(None),
+                           _last_used < _gained_last_used),
+                       _gained_last_used)],
+                     else_=_last_used)))
+
+@event.listens_for(Entry.status, 'set', active_history=True)
+def _load_old_status(entry, value, old_value, initiator):
+    # Listening with active_history loads the status being replaced when it
+    # was expired, so that the flush can tell what the entry was.
+    pass
+
+# The statistics are written by the flush which changes the entries, so
+# they commit or roll back together with them.
+@event.listens_for(Session, 'after_flush')
+def _update_tag_stats(session, flush_context):
+    gained, lost = _usage_changes(session)
+    # Counting up is enough for the tags which only gained entries, those
+    # which lost one need their newest entry looked up again.
+    updates = [{'gained_tag_id': tag_id, 'gained_count': count,
+                'gained_last_used': last_used}
+               for tag_id, (count, last_used) in gained.items()
+               if tag_id not in lost]
+    if updates:
+        session.connection().execute(_gain, updates)
+    if lost:
+        rebuild_tag_stats(session.connection(), lost)
+
+@event.listens_for(Tag, 'after_insert')
+def _add_tag_stats(mapper, connection, tag):
+    connection.execute(_stats_table.insert().values(
+        tag_id=tag.id, entry_count=0))
+
+@event.listens_for(Tag, 'before_delete')
+def _delete_tag_stats(mapper, connection, tag):
+    connection.execute(
+        _stats_table.delete().where(_stats_table.c.tag_id == tag.id))
@@ -0,0 +1,140 @@
+from sqlalchemy import event, select
+from sqlalchemy.orm import make_transient_to_detached
+
+from app import app, db
+from cache import MemoryCache, tag_key
+from models import Tag, TagStats
+from slugs import slugify, unique_slug
+
+_tag_table = Tag.__table__
+_stats_table = TagStats.__table__
+
+# Detached Tag instances keyed by name. Each form merges its own copies into
+# the request session, which does not hit the database.
+tag_cache = MemoryCache(
+    max_entries=app.config['TAG_CACHE_MAX_ENTRIES'],
+    default_ttl=app.config['TAG_CACHE_TTL'])
+
+def parse_tag_names(tag_string):
+    """
+    Split a comma-separated list of tags into names, dropping blank and
+    repeated ones.
+    """
+    names = []
+    for name in tag_string.split(','):
+        name = name.strip()
+        if name and name not in names:
+            names.append(name)
+    return names
+
+# Rounds of inserts before giving up on slugs taken by concurrent writers.
+_INSERT_ATTEMPTS = 5
+
+def _rows_by_name(connection, names):
+    query = (select([_tag_table.c.id, _tag_table.c.name, _tag_table.c.slug])
+             .where(_tag_table.c.name.in_(names)))
+    return dict((row.name, row) for row in connection.execute(query))
+
+def _insert_ignore(connection, table, rows):
+    """
+    Insert the rows, skipping those which conflict with an existing row on
+    any unique column, such as a tag just created by a concurrent writer.
+    """
+    if connection.dialect.name == 'sqlite':
+        connection.execute(table.insert().prefix_with('OR IGNORE'), rows)
+        return
+    statement = table.insert().compile(dialect=connection.dialect,
+                                       column_keys=list(rows[0]))
+    connection.execute('{} ON CONFLICT DO NOTHING'.format(statement), rows)
+
+def _insert_missing(connection, names, rows, slugs=None):
+    """
+    Insert the tags of the names which are not in rows, a dictionary of
+    names to tag rows, and add them to it. A name inserted meanwhile by
+    another writer is skipped by the unique index on the name, a slug taken
+    meanwhile leaves its name missing, it is numbered again in the next
+    round.
+    """
+    slugs = slugs or {}
+    slug_column = _tag_table.c.slug
+    # Slugs this call tried, whether they went in or turned out taken.
+    tried = set()
+    for attempt in range(_INSERT_ATTEMPTS):
+        missing = [name for name in names if name not in rows]
+        if not missing:
+            return
+        new_rows = []
+        for name in missing:
+            slug = unique_slug(connection, slug_column,
+                               slugs.get(name) or slugify(name),
+                               reserved=tried)
+            tried.add(slug)
+            new_rows.append({'name': name, 'slug': slug})
+        _insert_ignore(connection, _tag_table, new_rows)
+        inserted = _rows_by_name(connection, missing)
+        if inserted:
+            # Tags inserted here skip the mapper events of tag_stats.
+            _insert_ignore(connection, _stats_table,
+                           [{'tag_id': row.id, 'entry_count': 0}
+                            for row in inserted.values()])
+        rows.update(inserted)
+    missing = [name for name in names if name not in rows]
+    if missing:
+        raise RuntimeError('Could not insert the tags {}'.format(
+            ', '.join(missing)))
+
+def resolve_tag_ids(connection, names, slugs=None):
+    """
+    Return a dictionary mapping each of the names to the id of its tag, in
+    one query when every tag exists. Missing tags are inserted with the
+    slug given by slugs, a dictionary of names to slugs, or the slugified
+    name, numbered when another tag already has it.
+    """
+    names = list(names)
+    if not names:
+        return {}
+    rows = _rows_by_name(connection, names)
+    _insert_missing(connection, names, rows, slugs)
+    return dict((name, rows[name].id) for name in names)
+
+def _detached_tag(row):
+    tag = Tag(name=row.name)
+    tag.id = row.id
+    tag.slug = row.slug
+    make_transient_to_detached(tag)
+    return tag
+
+def resolve_tags(names):
+    """
+    Return the tags of the given names, in the current session. Cached
+    tags cost no query, the others are looked up with one. Missing tags are
+    inserted on the connection of the session, so that they are committed
+    along with the entry they are given to, and a form which is not saved
+    leaves none behind.
+    """
+    tags = {}
+    missing = []
+    for name in names:
+        tag = tag_cache.get(name)
+        if tag is None:
+            missing.append(name)
+        else:
+            tags[name] = tag
+    if missing:
+        connection = db.session.connection()
+        rows = _rows_by_name(connection, missing)
+        for name, row in rows.items():
+            # Only committed tags are cached.
+            tags[name] = _detached_tag(row)
+            tag_cache.set(name, tags[name], dependencies=(tag_key(row.id),))
+        new_names = [name for name in missing if name not in rows]
+        if new_names:
+            _insert_missing(connection, new_names, rows)
+            for name in new_names:
+                tags[name] = _detached_tag(rows[name])
+    return [db.session.merge(tags[name], load=False) for name in names]
+
+@event.listens_for(Tag, 'after_update')
+@event.listens_for(Tag, 'after_delete')
+def _invalidate_tag(mapper, connection, tag):
+    tag_cache.invalidate([tag_key(tag.id)])
@@ -0,0 +1,89 @@
+"""
+Shared fixtures. The tests run against a throwaway database seeded once per
+session, with the page and identity caches off so that every request reaches
+the database.
+
+    python -m pytest tests
+"""
+import os, shutil, sys, tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app
+
+# This has to be set before main is imported, the first session binds to the
+# engine.
+TEST_DIR = tempfile.mkdtemp()
+app.config.update(
+    SQLALCHEMY_DATABASE_URI='sqlite:///{}'.format(
+        os.path.join(TEST_DIR, 'test.db')),
+    TESTING=True,
+    PRESERVE_CONTEXT_ON_EXCEPTION=False,
+    PAGE_CACHE_ENABLED=False,
+    USER_CACHE_ENABLED=False,
+    COMMENT_RATE_LIMIT_ENABLED=False,
+    PASSWORD_POOL_WORKERS=0,
+    JOB_QUEUE_PATH=os.path.join(TEST_DIR, 'jobs.db'),
+    IMAGES_DIR=os.path.join(TEST_DIR, 'images'),
+    RATE_LIMIT_PATH=os.path.join(TEST_DIR, 'ratelimit.db'),
+    PAGE_CACHE_PATH=os.path.join(TEST_DIR, 'page_cache.db'),
+)
+
+from main import db, search
+from models import Comment, Entry, Tag, User
+
+AUTHOR_EMAIL = 'author@example.com'
+AUTHOR_PASSWORD = 'secret'
+
+@pytest.fixture(scope='session')
+def database():
+    """
+    Create the schema and seed it with 60 entries, some of them drafts,
+    spread over 5 tags, with 3 comments each.
+    """
+    db.create_all()
+    search.create_index(db.engine)
+    author = User.create(AUTHOR_EMAIL, AUTHOR_PASSWORD, name='Author',
+                         admin=True)
+    tags = [Tag(name='tag {}'.format(i)) for i in range(5)]
+    db.session.add(author)
+    for i in range(60):
+        entry = Entry(title='Entry {}'.format(i), body='Body of entry',
+                      author=author, tags=tags[:i % 5 + 1],
+                      status=(Entry.STATUS_DRAFT if i % 7 == 0
+                              else Entry.STATUS_PUBLIC))
+        db.session.add(entry)
+        for j in range(3):
+            db.session.add(Comment(name='Reader', email='r@example.com',
+                                   body='Comment body', entry=entry,
+                                   status=Comment.STATUS_PUBLIC))
+    db.session.commit()
+    yield db
+    db.session.remove()
+    shutil.rmtree(TEST_DIR, ignore_errors=True)
+
+@pytest.fixture
+def client(database):
+    return app.test_client()
+
+@pytest.fixture
+def author_client(database):
+    client = app.test_client()
+    client.post('/login/', data={'email': AUTHOR_EMAIL,
+                                 'password': AUTHOR_PASSWORD})
+    # Logging in flashes a message, which the next page pops.
+    client.get('/')
+    return client
+
+@pytest.fixture
+def entry(database):
+    return (Entry.query
+            .filter(Entry.status == Entry.STATUS_PUBLIC)
+            .order_by(Entry.id)
+            .first())
+
+@pytest.fixture
+def tag(database):
+    return Tag.query.order_by(Tag.id).first()
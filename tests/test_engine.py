@@ -0,0 +1,81 @@
+"""
+Engine profile: the connect-time PRAGMAs, the connection pool, and readers
+and writers sharing the database without lock errors.
+"""
+import json, threading
+
+from sqlalchemy.pool import QueuePool
+
+from app import app, db
+from models import Entry
+
+def pragma(connection, name):
+    return connection.execute('PRAGMA {}'.format(name)).scalar()
+
+def test_sqlite_pragmas(database):
+    with db.engine.connect() as connection:
+        assert pragma(connection, 'journal_mode') == 'wal'
+        # NORMAL
+        assert pragma(connection, 'synchronous') == 1
+        assert pragma(connection, 'busy_timeout') == 5000
+        # MEMORY
+        assert pragma(connection, 'temp_store') == 2
+
+def test_pool(database):
+    pool = db.engine.pool
+    assert isinstance(pool, QueuePool)
+    assert pool.size() == app.config['SQLALCHEMY_POOL_SIZE']
+    # A connection returned to the pool is handed out again, rather than a
+    # new one being opened and tuned.
+    connection = db.engine.raw_connection()
+    dbapi_connection = connection.connection
+    connection.close()
+    connection = db.engine.raw_connection()
+    try:
+        assert connection.connection is dbapi_connection
+    finally:
+        connection.close()
+
+def test_concurrent_reads_and_writes(database):
+    # Comments are only accepted on public entries.
+    entry_ids = [entry_id for entry_id, in db.session.query(Entry.id)
+                 .filter(Entry.status == Entry.STATUS_PUBLIC)
+                 .order_by(Entry.id)]
+    db.session.remove()
+    errors = []
+
+    def read(client, i):
+        response = client.get('/entries/')
+        response.get_data()
+        assert response.status_code == 200
+
+    def post_comment(client, i):
+        response = client.post('/api/comment', data=json.dumps({
+            'name': 'Reader', 'email': 'r@example.com',
+            'body': 'A concurrent comment.',
+            'entry_id': entry_ids[i % len(entry_ids)]}),
+            content_type='application/json')
+        assert response.status_code == 201
+
+    def save_entry(client, i):
+        with app.app_context():
+            entry = Entry.query.get(entry_ids[i % len(entry_ids)])
+            entry.body = 'Edited body {}'.format(i)
+            db.session.commit()
+
+    def worker(action):
+        client = app.test_client()
+        for i in range(20):
+            try:
+                action(client, i)
+            except Exception as error:
+                errors.append(error)
+
+    actions = [read] * 4 + [post_comment] * 2 + [save_entry] * 2
+    threads = [threading.Thread(target=worker, args=(action,))
+               for action in actions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
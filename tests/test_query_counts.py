@@ -0,0 +1,66 @@
+"""
+Statement budgets of the list and detail pages. Each page runs a fixed
+number of statements, however many entries, tags and comments it shows.
+"""
+import re
+
+import pytest
+
+from instrumentation import count_queries
+from models import Entry, Tag
+
+NEXT_PAGE = re.compile(r'href="\./\?cursor=([^"]+)">&raquo;')
+
+def queries(client, url):
+    # Streamed pages only query the database as their body is read.
+    with count_queries() as counter:
+        response = client.get(url)
+        response.get_data()
+    assert response.status_code == 200
+    return counter.count
+
+# The author additionally loads the logged-in user once per request.
+@pytest.mark.parametrize('url, anonymous, author', [
+    ('/entries/', 1, 2),
+    ('/entries/?q=body', 2, 3),
+    ('/entries/tags/', 2, 3),
+    ('/entries/tags/{tag.slug}/', 2, 3),
+    ('/entries/{entry.slug}/', 4, 5),
+    ('/api/comment', 2, 2),
+])
+def test_page_budget(client, author_client, entry, tag, url, anonymous,
+                     author):
+    url = url.format(entry=entry, tag=tag)
+    assert queries(client, url) <= anonymous
+    assert queries(author_client, url) <= author
+
+def test_entry_list_pages(client):
+    # A full first page and a shorter last page run the same statements.
+    url = '/entries/'
+    while True:
+        html = client.get(url).get_data(as_text=True)
+        match = NEXT_PAGE.search(html)
+        if match is None:
+            break
+        url = '/entries/?cursor={}'.format(match.group(1))
+    assert url != '/entries/'
+    assert queries(client, url) == queries(client, '/entries/')
+
+def test_detail_tags(client):
+    # Tags are loaded together, not one by one.
+    entries = (Entry.query
+               .filter(Entry.status == Entry.STATUS_PUBLIC)
+               .order_by(Entry.id)
+               .all())
+    one_tag = next(entry for entry in entries if len(entry.tags) == 1)
+    all_tags = next(entry for entry in entries
+                    if len(entry.tags) == Tag.query.count())
+    assert queries(client, '/entries/{}/'.format(all_tags.slug)) == \
+        queries(client, '/entries/{}/'.format(one_tag.slug))
+
+def test_admin_entry_list(author_client):
+    # The tag_list and author columns must not trigger a query per row.
+    full_page = queries(author_client, '/admin/entry/')
+    single_row = queries(author_client, '/admin/entry/?search=Entry+59')
+    assert full_page == single_row
+    assert full_page <= 11
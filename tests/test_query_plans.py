@@ -0,0 +1,207 @@
+"""
+Query plan regressions. Every SELECT issued by the entry and comment pages
+has to use an index, the paginated lists have to be read in order from one
+rather than sorted, and the indexes have to come out of the migrations as
+declared on the models.
+"""
+import json, os, re
+
+import pytest
+import sqlalchemy
+from flask import Flask, g
+from flask.ext.login import AnonymousUserMixin
+from flask.ext.migrate import Migrate, downgrade, stamp, upgrade
+from sqlalchemy import event
+
+from app import app, db
+from entries.blueprint import entry_list
+from helpers import encode_cursor
+from models import Comment, Entry
+
+MIGRATIONS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+
+# The revision adding the indexes, and the one before it.
+INDEX_REVISION = 'e5a07f3b8c21'
+PRE_INDEX_REVISION = 'c41d8e6f2a57'
+
+# "SCAN TABLE entry" before SQLite 3.36, "SCAN entry" since. Scans using an
+# index ("SCAN entry USING INDEX ...") walk the index in order and are fine.
+FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$')
+
+# A page of a list ends with LIMIT, and has to stop reading once it is full.
+# Search results are ranked on the fly and cannot come out of an index.
+PAGINATED = re.compile(r'LIMIT \?(?: OFFSET \?)?\s*$')
+RANKED = 'bm25('
+
+NEXT_PAGE = re.compile(r'href="\./\?cursor=([^"]+)">&raquo;')
+
+def query_plan(statement, parameters=()):
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+        return [row[-1] for row in cursor.fetchall()]
+    finally:
+        connection.close()
+
+def full_scans(statement, parameters):
+    return [detail for detail in query_plan(statement, parameters)
+            if FULL_SCAN.match(detail) and
+            FULL_SCAN.match(detail).group(1) in db.metadata.tables]
+
+def sorts(statement, parameters):
+    if not PAGINATED.search(statement) or RANKED in statement:
+        return []
+    return [detail for detail in query_plan(statement, parameters)
+            if 'TEMP B-TREE' in detail]
+
+def record_selects(statements):
+    """
+    Listen for the SELECT statements issued, appending them to statements.
+    Returns the listener, for event.remove.
+    """
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+    event.listen(db.engine, 'before_cursor_execute', record)
+    return record
+
+def captured_selects(client, urls):
+    """
+    Request each url, and the second page of results when there is one,
+    returning the SELECT statements issued.
+    """
+    statements = []
+    record = record_selects(statements)
+    try:
+        for url in urls:
+            html = client.get(url).get_data(as_text=True)
+            match = NEXT_PAGE.search(html)
+            if match:
+                client.get('{}?cursor={}'.format(url, match.group(1)))
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    return statements
+
+@pytest.fixture
+def urls(entry, tag):
+    comment_filter = json.dumps({'filters': [
+        {'name': 'entry_id', 'op': 'eq', 'val': entry.id}]})
+    return [
+        '/entries/',
+        '/entries/?q=body',
+        '/entries/tags/',
+        '/entries/tags/{}/'.format(tag.slug),
+        '/entries/{}/'.format(entry.slug),
+        '/api/comment',
+        '/api/comment?cursor=10',
+        '/api/comment?q={}'.format(comment_filter),
+    ]
+
+@pytest.fixture
+def author_urls(urls, database):
+    # The author also reads their drafts, and the pages only they can reach.
+    draft = (Entry.query
+             .filter(Entry.status == Entry.STATUS_DRAFT)
+             .order_by(Entry.id)
+             .first())
+    return urls + [
+        '/entries/{}/'.format(draft.slug),
+        '/entries/{}/edit/'.format(draft.slug),
+        '/entries/?q=entry',
+    ]
+
+@pytest.mark.parametrize('visitor, visitor_urls', [
+    ('client', 'urls'), ('author_client', 'author_urls')])
+def test_query_plans(request, visitor, visitor_urls):
+    statements = captured_selects(request.getfixturevalue(visitor),
+                                  request.getfixturevalue(visitor_urls))
+    assert statements
+    problems = dict((statement, full_scans(statement, parameters) +
+                                sorts(statement, parameters))
+                    for statement, parameters in statements)
+    assert dict((statement, found) for statement, found in problems.items()
+                if found) == {}
+
+def _plan_of(query):
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    parameters = [compiled.params[name] for name in compiled.positiontup]
+    return ' '.join(query_plan(str(compiled), parameters))
+
+def _entry_list_plans(user):
+    """
+    Build the first and a later page of the entry list through entry_list,
+    as the given user, and return the plans of the queries reading them.
+    """
+    columns = (Entry.created_timestamp, Entry.id)
+    middle = Entry.query.order_by(Entry.id).offset(30).first()
+    with app.app_context():
+        cursor = encode_cursor(middle, columns, 'next')
+    plans = []
+    for path in ('/entries/', '/entries/?cursor={}'.format(cursor)):
+        statements = []
+        with app.test_request_context(path):
+            g.user = user
+            record = record_selects(statements)
+            try:
+                entry_list('entries/index.html',
+                           Entry.query.order_by(Entry.created_timestamp.desc()))
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+        plans.extend(' '.join(query_plan(statement, parameters))
+                     for statement, parameters in statements
+                     if 'FROM entry' in statement and
+                     PAGINATED.search(statement))
+    return plans
+
+@pytest.mark.parametrize('visitor, index', [
+    ('anonymous', 'ix_entry_status_created'),
+    ('author', 'ix_entry_created')])
+def test_entry_list_plan(database, visitor, index):
+    # Anonymous visitors read the public entries, authors their drafts as
+    # well. Either way a page is read newest first from an index, on the
+    # first page and on the next ones, instead of sorted.
+    if visitor == 'anonymous':
+        user = AnonymousUserMixin()
+    else:
+        user = Entry.query.first().author
+    plans = _entry_list_plans(user)
+    assert len(plans) == 2
+    for plan in plans:
+        assert index in plan
+        assert 'TEMP B-TREE' not in plan
+
+def test_comment_plan(entry):
+    query = (Comment.query
+             .filter(Comment.entry_id == entry.id)
+             .filter(Comment.status == Comment.STATUS_PUBLIC)
+             .order_by(Comment.id))
+    assert 'ix_comment_entry_status' in _plan_of(query)
+
+def _indexes(engine):
+    inspector = sqlalchemy.inspect(engine)
+    return dict((table, set(index['name']
+                            for index in inspector.get_indexes(table)))
+                for table in ('entry', 'comment', 'tag', 'entry_tags'))
+
+def test_migration_indexes(tmpdir):
+    url = 'sqlite:///{}'.format(tmpdir.join('migrations.db'))
+    engine = sqlalchemy.create_engine(url)
+    db.metadata.create_all(engine)
+    declared = _indexes(engine)
+
+    # Alembic reads the database URL from the current app, keep the test
+    # database out of it.
+    migration_app = Flask('app')
+    migration_app.config['SQLALCHEMY_DATABASE_URI'] = url
+    Migrate(migration_app, db)
+    with migration_app.app_context():
+        stamp(directory=MIGRATIONS_DIR)
+        downgrade(directory=MIGRATIONS_DIR, revision=PRE_INDEX_REVISION)
+        before = _indexes(engine)
+        upgrade(directory=MIGRATIONS_DIR)
+    assert 'ix_entry_status_created' not in before['entry']
+    assert _indexes(engine) == declared
+    primary_key = sqlalchemy.inspect(engine).get_pk_constraint('entry_tags')
+    assert set(primary_key['constrained_columns']) == {'entry_id', 'tag_id'}
@@ -3,17 +3,28 @@ from flask.ext.login import login_user, logout_user
 
 from app import app, login_manager
 from forms import LoginForm
+from fragments import get_fragments
+from instrumentation import timed
 
 @app.route('/')
 def homepage():
-    return render_template('homepage.html')
+    """
+    Assemble the homepage from fragments rendered in the background, which
+    does not query the database once they are rendered.
+    """
+    fragments = get_fragments('recent_entries', 'popular_tags',
+                              'recent_comments')
+    return render_template('homepage.html', fragments=fragments)
     
 @app.route('/login/', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         form = LoginForm(request.form)
-        # The user is validated and authenticated.
-        if form.validate():
+        # The user is validated and authenticated, which checks the
+        # password as well.
+        with timed('forms'):
+            valid = form.validate()
+        if valid:
             # login_user handles setting the correct session values.
             login_user(form.user, remember=form.remember_me.data)
             flash("Successfully logged in as {}.".format(form.user.email), 